@@ -1,20 +1,50 @@
 
+from __future__ import annotations
+
 import logging
 import os
 import sys
-from time import time
-from typing import Tuple, IO, Union, List, cast
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple, IO, Union
 
-from PIL import Image
+import numpy as np
 
+import pngwriter
 from bit_manipulation import (
-    lsb_deinterleave_list,
-    lsb_interleave_list,
+    lsb_deinterleave_array,
+    lsb_deinterleave_bytes,
+    lsb_interleave_array,
+    resolve_workers,
     roundup,
 )
+from inplace import clone_file, map_bytes
+from lazy import lazy_import
+from progress import CancelToken, ProgressCallback, report
+from timing import span, timed
+
+__all__ = [
+    "CHUNK_SIZE", "MULTI_FRAME_FORMATS", "FRAMES_MAGIC", "prepare_hide", "prepare_recover", "get_filesize",
+    "max_bits_to_hide", "bytes_in_max_file_size", "image_to_array", "array_to_image", "is_multi_frame",
+    "frame_capacities", "frames_size_tag_size", "frame_ranges", "image_capacity", "pack_payload", "prepare_payload",
+    "interleave_chunks", "deinterleave_chunks", "hide_message_in_image", "hide_message_in_frames", "frames_format",
+    "save_frames", "raw_pixel_view", "hide_data_in_place", "hide_data", "later_frames", "save_image", "read_rows",
+    "read_message_rows", "recover_message_from_image", "recover_message_from_frames", "recover_data", "analysis",
+]
 
 log = logging.getLogger(__name__)
 
+Image = lazy_import("PIL.Image")
+
+# Payload bytes interleaved or deinterleaved at once between progress reports
+CHUNK_SIZE = 1 << 20
+
+# Formats whose frames are all used, see is_multi_frame
+MULTI_FRAME_FORMATS = ("PNG", "TIFF")
+
+# Starts the data hidden across the frames of a multi-frame image, which older versions hid in the first frame alone
+FRAMES_MAGIC = b"HSMF"
+
 
 def _str_to_bytes(x: Union[bytes, str], charset: str = sys.getdefaultencoding(), errors: str = "strict") -> bytes:
     if x is None:
@@ -60,38 +90,274 @@ def bytes_in_max_file_size(image: Image.Image, num_lsb: int, num_channels: int)
     return roundup(max_bits_to_hide(image, num_lsb, num_channels).bit_length() / 8)
 
 
-def hide_message_in_image(input_image: Image.Image, message: Union[str, bytes], num_lsb: int,
-                          skip_storage_check: bool = False) -> Image.Image:
-    """Hides the message in the input image and returns the modified image object."""
-    start = time()
-    num_channels = len(input_image.getbands())
-    flattened_color_data = [v for t in input_image.getdata() for v in t]
-
+def image_to_array(image: Image.Image, writable: bool = True) -> np.ndarray:
+    """Returns a uint8 array of the image's color data, one value per channel per pixel."""
+    color_data = np.array(image) if writable else np.asarray(image)
+    if color_data.dtype != np.uint8:
+        raise ValueError(f"Images in mode {image.mode} are not supported, only 8 bits per channel")
+    return color_data
+
+
+def array_to_image(color_data: np.ndarray, template: Image.Image) -> Image.Image:
+    """Returns an image with the mode, size and palette of template backed by color_data."""
+    # Image.frombuffer shares memory with the array like Image.fromarray does, but
+    # keeps the template's mode instead of inferring one from the array shape (e.g. CMYK)
+    image = Image.frombuffer(template.mode, template.size, np.ascontiguousarray(color_data),
+                             "raw", template.mode, 0, 1)
+    palette = template.getpalette() if template.mode in ("P", "PA") else None
+    if palette is not None:
+        image.putpalette(palette)
+    image.info.update(template.info)
+    return image
+
+
+def is_multi_frame(image: Image.Image) -> bool:
+    """Returns whether image is an animated PNG or a multi-page TIFF, whose frames are all used
+    to hide data, in order. Other images only use their first frame."""
+    return image.format in MULTI_FRAME_FORMATS and getattr(image, "n_frames", 1) > 1
+
+
+def frame_capacities(image: Image.Image, num_lsb: int) -> List[int]:
+    """Returns the number of bytes each frame of a multi-frame image can hold with num_lsb LSBs.
+
+    The frames of an animated PNG have the size and mode of the image, while the pages
+    of a TIFF may differ, so only TIFFs are seeked through, which reads their headers."""
+    if image.format != "TIFF":
+        return [max_bits_to_hide(image, num_lsb, len(image.getbands())) // 8] * image.n_frames
+    position = image.tell()
+    capacities = []
+    for frame in range(image.n_frames):
+        image.seek(frame)
+        capacities.append(max_bits_to_hide(image, num_lsb, len(image.getbands())) // 8)
+    image.seek(position)
+    return capacities
+
+
+def frames_size_tag_size(capacities: List[int]) -> int:
+    """Returns the size of the size tag of a multi-frame image, based on the capacity of all its frames
+    past FRAMES_MAGIC. Both must fit in the first frame for data to be hidden across the frames."""
+    return roundup((8 * (sum(capacities) - len(FRAMES_MAGIC))).bit_length() / 8)
+
+
+def frame_ranges(capacities: List[int], num_bytes: int) -> List[Tuple[int, int]]:
+    """Returns the (start, end) range of the num_bytes payload bytes held by each frame,
+    up to the last frame holding any."""
+    ranges = []
+    start = 0
+    for capacity in capacities:
+        if start >= num_bytes:
+            break
+        ranges.append((start, min(start + capacity, num_bytes)))
+        start += capacity
+    return ranges
+
+
+def image_capacity(image: Image.Image, num_lsb: int) -> Tuple[int, int]:
+    """Returns the number of bytes image can hold with num_lsb LSBs, in all its frames
+    if it is a multi-frame image, and the size of its size tag."""
+    if is_multi_frame(image):
+        capacities = frame_capacities(image, num_lsb)
+        return sum(capacities) - len(FRAMES_MAGIC), frames_size_tag_size(capacities)
+    num_channels = len(image.getbands())
+    return max_bits_to_hide(image, num_lsb, num_channels) // 8, bytes_in_max_file_size(image, num_lsb, num_channels)
+
+
+def pack_payload(message: Union[str, bytes], max_bits: int, num_lsb: int, skip_storage_check: bool = False) -> bytes:
+    """Returns the message prefixed with its size tag, whose size is given by the max_bits bits
+    the image can hold, checking that it fits."""
     # We add the size of the input file to the beginning of the payload.
     message_size = len(message)
-    file_size_tag = message_size.to_bytes(bytes_in_max_file_size(input_image, num_lsb, num_channels),
-                                          byteorder=sys.byteorder)
+    file_size_tag = message_size.to_bytes(roundup(max_bits.bit_length() / 8), byteorder=sys.byteorder)
     data = file_size_tag + _str_to_bytes(message)
-    log.debug(f"{'Files read':<30} in {time() - start:.2f}s")
 
-    if 8 * len(data) > max_bits_to_hide(input_image, num_lsb, num_channels) and not skip_storage_check:
-        raise ValueError(f"Only able to hide {max_bits_to_hide(input_image, num_lsb, num_channels) // 8} bytes in "
+    if 8 * len(data) > max_bits and not skip_storage_check:
+        raise ValueError(f"Only able to hide {max_bits // 8} bytes in "
                          f"this image with {num_lsb} LSBs, but {len(data)} bytes were requested")
+    return data
 
-    start = time()
-    flattened_color_data = lsb_interleave_list(flattened_color_data, data, num_lsb)
-    log.debug(f"{f'{message_size} bytes hidden':<30} in {time() - start:.2f}s")
 
-    start = time()
-    # PIL expects a sequence of tuples, one per pixel
-    input_image.putdata(cast(List[int], list(zip(*[iter(flattened_color_data)] * num_channels))))
-    log.debug(f"{'Image overwritten':<30} in {time() - start:.2f}s")
-    return input_image
+def prepare_payload(input_image: Image.Image, message: Union[str, bytes], num_lsb: int,
+                    skip_storage_check: bool = False) -> bytes:
+    """Returns the message prefixed with its size tag, checking that it fits in the image."""
+    num_channels = len(input_image.getbands())
+    return pack_payload(message, max_bits_to_hide(input_image, num_lsb, num_channels), num_lsb, skip_storage_check)
+
+
+def interleave_chunks(color_data: np.ndarray, data: bytes, num_lsb: int, workers: int = 1,
+                      progress: Optional[ProgressCallback] = None, cancel: Optional[CancelToken] = None) -> None:
+    """Interleaves data into color_data in place. If progress or cancel are given, it is done
+    CHUNK_SIZE bytes at a time, reporting progress and checking cancel after each chunk."""
+    values = color_data.reshape(-1)
+    # a chunk of a multiple of num_lsb bytes fills a whole number of values
+    chunk_size = roundup(CHUNK_SIZE, num_lsb) if progress is not None or cancel is not None else max(len(data), 1)
+    for start in range(0, len(data), chunk_size):
+        end = min(start + chunk_size, len(data))
+        lsb_interleave_array(values[8 * start // num_lsb:], memoryview(data)[start:end], num_lsb, workers)
+        report(end, len(data), progress, cancel)
+
+
+def deinterleave_chunks(color_data: np.ndarray, num_bytes: int, num_lsb: int, workers: int = 1,
+                        progress: Optional[ProgressCallback] = None,
+                        cancel: Optional[CancelToken] = None) -> np.ndarray:
+    """Deinterleaves num_bytes bytes from color_data, CHUNK_SIZE bytes at a time if progress
+    or cancel are given, reporting progress and checking cancel after each chunk."""
+    values = color_data.reshape(-1)
+    data = np.empty(num_bytes, dtype=np.uint8)
+    chunk_size = roundup(CHUNK_SIZE, num_lsb) if progress is not None or cancel is not None else max(num_bytes, 1)
+    for start in range(0, num_bytes, chunk_size):
+        end = min(start + chunk_size, num_bytes)
+        lsb_deinterleave_bytes(values[8 * start // num_lsb:], 8 * (end - start), num_lsb, workers=workers,
+                               out=data[start:end])
+        report(end, num_bytes, progress, cancel)
+    return data
 
 
+def hide_message_in_image(input_image: Image.Image, message: Union[str, bytes], num_lsb: int,
+                          skip_storage_check: bool = False, workers: int = 1,
+                          progress: Optional[ProgressCallback] = None,
+                          cancel: Optional[CancelToken] = None) -> Image.Image:
+    """Hides the message in the input image and returns the modified image object."""
+    with span("Files read"):
+        color_data = image_to_array(input_image)
+        data = prepare_payload(input_image, message, num_lsb, skip_storage_check)
+
+    with span("Bytes hidden", len(message)):
+        interleave_chunks(color_data, data, num_lsb, workers, progress, cancel)
+
+    with span("Image overwritten", color_data.nbytes):
+        return array_to_image(color_data, input_image)
+
+
+def hide_message_in_frames(input_image: Image.Image, message: Union[str, bytes], num_lsb: int,
+                           skip_storage_check: bool = False, workers: int = 1,
+                           progress: Optional[ProgressCallback] = None,
+                           cancel: Optional[CancelToken] = None) -> List[Image.Image]:
+    """Hides the message across the frames of a multi-frame image, filling each frame in turn,
+    and returns every frame of the modified image (see save_frames). The payload starts with
+    FRAMES_MAGIC, which tells it apart from data hidden in the first frame alone.
+
+    Frames are decoded one after the other, as those of an animation build on each other,
+    while the message is hidden in the frames already decoded on workers threads."""
+    with span("Files read"):
+        capacities = frame_capacities(input_image, num_lsb)
+        file_size_tag_size = frames_size_tag_size(capacities)
+        if capacities[0] < len(FRAMES_MAGIC) + file_size_tag_size:
+            raise ValueError(f"The first frame can only hold {capacities[0]} B, but the header takes "
+                             f"{len(FRAMES_MAGIC) + file_size_tag_size} B")
+        data = FRAMES_MAGIC + pack_payload(message, 8 * (sum(capacities) - len(FRAMES_MAGIC)), num_lsb,
+                                           skip_storage_check)
+        ranges = frame_ranges(capacities, len(data))
+
+    lock = threading.Lock()
+    hidden = 0
+
+    def hide_in_frame(frame: Image.Image, start: int, end: int) -> Image.Image:
+        nonlocal hidden
+        color_data = image_to_array(frame)
+        interleave_chunks(color_data, data[start:end], num_lsb, cancel=cancel)
+        with lock:
+            hidden += end - start
+            report(hidden, len(data), progress)
+        return array_to_image(color_data, frame)
+
+    with span("Bytes hidden", len(message)), ThreadPoolExecutor(resolve_workers(workers)) as pool:
+        frames: List[Union[Image.Image, Future]] = []
+        for frame in range(input_image.n_frames):
+            report(hidden, len(data), cancel=cancel)
+            input_image.seek(frame)
+            if frame < len(ranges):
+                frames.append(pool.submit(hide_in_frame, input_image.copy(), *ranges[frame]))
+            else:
+                frames.append(input_image.copy())
+        return [frame.result() if isinstance(frame, Future) else frame for frame in frames]
+
+
+def frames_format(steg_image_path: str) -> str:
+    """Returns the format of a multi-frame image saved to steg_image_path, given by its extension."""
+    image_format = Image.registered_extensions().get(os.path.splitext(steg_image_path)[1].lower())
+    if image_format not in MULTI_FRAME_FORMATS:
+        raise ValueError(f"Multi-frame images can only be saved as {' or '.join(MULTI_FRAME_FORMATS)}, "
+                         f"not to {steg_image_path}")
+    return image_format
+
+
+def save_frames(frames: List[Image.Image], fp: Union[str, IO[bytes]], image_format: str,
+                compression_level: int) -> None:
+    """Saves the frames returned by hide_message_in_frames as a PNG or TIFF to fp, a path or a binary file.
+
+    Animated PNG frames are written whole, without blending or disposal, with their
+    own durations. Pillow would merge identical consecutive frames, dropping one of
+    them along with its capacity, so these are refused."""
+    image_format = image_format.upper()
+    if image_format not in MULTI_FRAME_FORMATS:
+        raise ValueError(f"Multi-frame images can only be saved as {' or '.join(MULTI_FRAME_FORMATS)}")
+
+    options = {}
+    if image_format == "PNG":
+        for frame in range(1, len(frames)):
+            if frames[frame].tobytes() == frames[frame - 1].tobytes():
+                raise ValueError(f"Frames {frame - 1} and {frame} are identical, which an animated PNG can't keep")
+        # disposal and blend 0 are APNG_DISPOSE_OP_NONE and APNG_BLEND_OP_SOURCE
+        options = dict(duration=[frame.info.get("duration", 0) for frame in frames], disposal=0, blend=0)
+    frames[0].save(fp, image_format, compress_level=compression_level, save_all=True, append_images=frames[1:],
+                   optimize=False, **options)
+
+
+def raw_pixel_view(pixel_bytes: np.ndarray, image: Image.Image) -> np.ndarray:
+    """Returns a (height, width, channels) view in RGB order of the uncompressed pixel
+    array of image, given the file's bytes starting at the pixel array."""
+    _, _, _, (rawmode, stride, orientation) = image.tile[0]
+    width, height = image.size
+    bytes_per_pixel = len(rawmode)
+    stride = stride or width * bytes_per_pixel
+    rows = pixel_bytes[:stride * height].reshape(height, stride)[:, :width * bytes_per_pixel]
+    pixels = rows.reshape(height, width, bytes_per_pixel)
+    if orientation < 0:
+        # bottom-up bitmap, the first row in the file is the last row of the image
+        pixels = pixels[::-1]
+    # BGR or BGRX to RGB, the padding byte isn't part of the image
+    return pixels[..., 2::-1]
+
+
+def hide_data_in_place(input_image_path: str, input_file_path: str, steg_image_path: str, num_lsb: int,
+                       skip_storage_check: bool = False, workers: int = 1,
+                       progress: Optional[ProgressCallback] = None, cancel: Optional[CancelToken] = None) -> None:
+    """Hides the data from the input file in a copy of an uncompressed bitmap, rewriting only the
+    pixels which hold it through a memory map."""
+    with Image.open(input_image_path) as image, open(input_file_path, "rb") as input_file:
+        if image.format != "BMP" or len(image.tile) != 1 or image.tile[0][0] != "raw" \
+                or image.tile[0][3][0] not in ("BGR", "BGRX"):
+            raise ValueError("In place hiding is only supported for uncompressed 24 or 32 bit bitmaps")
+
+        with span("Files read and copied"):
+            data = prepare_payload(image, input_file.read(), num_lsb, skip_storage_check)
+            clone_file(input_image_path, steg_image_path)
+
+        width, height = image.size
+        pixel_offset = image.tile[0][2]
+        stride = image.tile[0][3][1]
+        # only the rows which hold the payload are copied out, interleaved and written back
+        rows_to_hide = min(height, roundup(roundup(8 * len(data) / num_lsb) / (3 * width)))
+        with span("Bytes hidden", len(data)), \
+                map_bytes(steg_image_path, pixel_offset, stride * height) as pixel_bytes:
+            pixels = raw_pixel_view(pixel_bytes, image)[:rows_to_hide]
+            color_data = np.ascontiguousarray(pixels)
+            interleave_chunks(color_data, data, num_lsb, workers, progress, cancel)
+            pixels[...] = color_data
+
+
+@timed("LSBSteg.hide_data")
 def hide_data(input_image_path: str, input_file_path: str, steg_image_path: str, num_lsb: int,
-              compression_level: int, skip_storage_check: bool = False) -> None:
-    """Hides the data from the input file in the input image."""
+              compression_level: int, skip_storage_check: bool = False, in_place: bool = False,
+              workers: int = 1, progress: Optional[ProgressCallback] = None,
+              cancel: Optional[CancelToken] = None, png_workers: int = 1) -> None:
+    """Hides the data from the input file in the input image.
+
+    If in_place is True, the input image must be an uncompressed bitmap, which is
+    copied to the output path and patched in place (see hide_data_in_place).
+    workers is the number of threads to interleave with, < 1 for one per core.
+    progress and cancel are called and checked as the data is hidden, see progress.py.
+    png_workers is the number of threads to encode a PNG output with, see save_image."""
     if input_image_path is None:
         raise ValueError("LSBSteg hiding requires an input image file path")
     if input_file_path is None:
@@ -99,42 +365,186 @@ def hide_data(input_image_path: str, input_file_path: str, steg_image_path: str,
     if steg_image_path is None:
         raise ValueError("LSBSteg hiding requires an output image file path")
 
+    if in_place:
+        hide_data_in_place(input_image_path, input_file_path, steg_image_path, num_lsb, skip_storage_check, workers,
+                           progress, cancel)
+        return
+
     image, input_file = prepare_hide(input_image_path, input_file_path)
     with image as image, input_file as input_file:
-        image = hide_message_in_image(image, input_file.read(), num_lsb, skip_storage_check=skip_storage_check)
-
-        # just in case is_animated is not defined, as suggested by the Pillow documentation
-        is_animated = getattr(image, "is_animated", False)
-        image.save(steg_image_path, compress_level=compression_level, save_all=is_animated)
-
-
-def recover_message_from_image(input_image: Image.Image, num_lsb: int) -> bytes:
-    """Returns the message from the steganographed image"""
-    start = time()
+        if is_multi_frame(image):
+            image_format = frames_format(steg_image_path)
+            frames = hide_message_in_frames(image, input_file.read(), num_lsb, skip_storage_check, workers, progress,
+                                            cancel)
+            with span("Image saved"):
+                save_frames(frames, steg_image_path, image_format, compression_level)
+            return
+
+        steg_image = hide_message_in_image(image, input_file.read(), num_lsb, skip_storage_check=skip_storage_check,
+                                           workers=workers, progress=progress, cancel=cancel)
+
+        with span("Image saved"):
+            save_image(steg_image, steg_image_path, compression_level, png_workers, later_frames(image))
+
+
+def later_frames(image: Image.Image) -> List[Image.Image]:
+    """Returns copies of the frames of an animated image after the first, which alone holds the data
+    unless the image is a multi-frame image (see is_multi_frame), to be saved along with it."""
+    # just in case is_animated is not defined, as suggested by the Pillow documentation
+    if not getattr(image, "is_animated", False):
+        return []
+    frames = []
+    for frame in range(1, image.n_frames):
+        image.seek(frame)
+        frames.append(image.copy())
+    image.seek(0)
+    return frames
+
+
+def save_image(image: Image.Image, steg_image_path: str, compression_level: int, png_workers: int = 1,
+               append_images: Sequence[Image.Image] = ()) -> None:
+    """Saves image to steg_image_path, in the format given by its extension, followed by the frames
+    of append_images if any (see later_frames).
+
+    Unless png_workers is 1, still PNGs are encoded by pngwriter on png_workers threads (< 1 for one
+    per core), images it can't write being saved by Pillow as usual."""
+    if png_workers != 1 and not append_images and steg_image_path.lower().endswith(".png") \
+            and pngwriter.supports(image):
+        pngwriter.save(image, steg_image_path, compression_level, png_workers)
+        return
+    image.save(steg_image_path, compress_level=compression_level, save_all=bool(append_images),
+               append_images=list(append_images))
+
+
+def read_rows(image: Image.Image, rows: int) -> np.ndarray:
+    """Returns the color data of the first rows of image.
+
+    Where the file format allows it, only those rows are decoded: Pillow decodes
+    non-interlaced PNGs and top-down uncompressed images row by row, so a
+    fresh copy of the image is opened with its size and tile cut to the rows
+    needed; bottom-up bitmaps are read from the end of a memory map. Anything
+    else falls back to decoding the whole image."""
+    width, height = image.size
+    rows = min(rows, height)
+    filename = getattr(image, "filename", None)
+    if rows == height or not filename or len(image.tile) != 1 or getattr(image, "n_frames", 1) > 1:
+        return image_to_array(image, writable=False)[:rows]
+
+    codec, _, offset, args = image.tile[0]
+    top_down = isinstance(args, str) or len(args) < 3 or args[2] >= 0
+    if codec == "zip" and not image.info.get("interlace") or codec == "raw" and top_down:
+        with Image.open(filename) as partial:
+            partial._size = (width, rows)
+            partial.tile = [(codec, (0, 0, width, rows), offset, args)]
+            return image_to_array(partial, writable=False)
+    if codec == "raw" and image.mode == "RGB" and args[0] in ("BGR", "BGRX"):
+        pixel_bytes = np.memmap(filename, dtype=np.uint8, mode="r", offset=offset)
+        return np.ascontiguousarray(raw_pixel_view(pixel_bytes, image)[:rows])
+    return image_to_array(image, writable=False)[:rows]
+
+
+def read_message_rows(input_image: Image.Image, num_lsb: int) -> Tuple[np.ndarray, int, int]:
+    """Returns the color data of the rows holding the message, the size of the size tag
+    and the size of the message, reading the size tag first."""
     num_channels = len(input_image.getbands())
-    color_data = [v for t in input_image.getdata() for v in t]
+    values_per_row = input_image.size[0] * num_channels
 
     file_size_tag_size = bytes_in_max_file_size(input_image, num_lsb, num_channels)
     tag_bit_height = roundup(8 * file_size_tag_size / num_lsb)
+    color_data = read_rows(input_image, roundup(tag_bit_height / values_per_row))
 
-    bytes_to_recover = int.from_bytes(lsb_deinterleave_list(color_data[:tag_bit_height], 8 * file_size_tag_size,
-                                                            num_lsb), byteorder=sys.byteorder)
+    bytes_to_recover = int.from_bytes(lsb_deinterleave_array(color_data.reshape(-1)[:tag_bit_height],
+                                                             8 * file_size_tag_size, num_lsb),
+                                      byteorder=sys.byteorder)
 
     maximum_bytes_in_image = (max_bits_to_hide(input_image, num_lsb, num_channels) // 8 - file_size_tag_size)
     if bytes_to_recover > maximum_bytes_in_image:
         raise ValueError(f"This image appears to be corrupted.\nIt claims to hold {bytes_to_recover} B, "
                          f"but can only hold {maximum_bytes_in_image} B with {num_lsb} LSBs")
 
-    log.debug(f"{'Files read':<30} in {time() - start:.2f}s")
-
-    start = time()
-    data = lsb_deinterleave_list(color_data, 8 * (bytes_to_recover + file_size_tag_size), num_lsb)[
-           file_size_tag_size:]
-    log.debug(f"{f'{bytes_to_recover} bytes recovered':<30} in {time() - start:.2f}s")
-    return data
-
-
-def recover_data(steg_image_path: str, output_file_path: str, num_lsb: int) -> None:
+    message_bit_height = roundup(8 * (bytes_to_recover + file_size_tag_size) / num_lsb)
+    color_data = read_rows(input_image, roundup(message_bit_height / values_per_row))
+    return color_data, file_size_tag_size, bytes_to_recover
+
+
+def recover_message_from_image(input_image: Image.Image, num_lsb: int, workers: int = 1,
+                               progress: Optional[ProgressCallback] = None,
+                               cancel: Optional[CancelToken] = None) -> bytes:
+    """Returns the message from the steganographed image
+
+    The size tag is read first, so that only the rows holding the message are decoded
+    (see read_message_rows), or only the frames holding it for a multi-frame image."""
+    if is_multi_frame(input_image):
+        message = recover_message_from_frames(input_image, num_lsb, workers, progress, cancel)
+        if message is not None:
+            return message
+        # hidden by an older version, which used the first frame alone
+        input_image.seek(0)
+
+    with span("Files read"):
+        color_data, file_size_tag_size, bytes_to_recover = read_message_rows(input_image, num_lsb)
+
+    with span("Bytes recovered", bytes_to_recover):
+        data = deinterleave_chunks(color_data, bytes_to_recover + file_size_tag_size, num_lsb, workers, progress,
+                                   cancel)
+        return data[file_size_tag_size:].tobytes()
+
+
+def recover_message_from_frames(input_image: Image.Image, num_lsb: int, workers: int = 1,
+                                progress: Optional[ProgressCallback] = None,
+                                cancel: Optional[CancelToken] = None) -> Optional[bytes]:
+    """Returns the message hidden across the frames of a multi-frame image by hide_message_in_frames,
+    or None if the first frame doesn't start with FRAMES_MAGIC.
+
+    The header is read from the first frame, then only the frames holding the message
+    are decoded, the message being recovered from each on workers threads."""
+    with span("Files read"):
+        capacities = frame_capacities(input_image, num_lsb)
+        file_size_tag_size = frames_size_tag_size(capacities)
+        header_size = len(FRAMES_MAGIC) + file_size_tag_size
+        if capacities[0] < header_size:
+            return None
+        input_image.seek(0)
+        first_frame = image_to_array(input_image, writable=False)
+        header = lsb_deinterleave_array(first_frame.reshape(-1)[:roundup(8 * header_size / num_lsb)],
+                                        8 * header_size, num_lsb)
+        if header[:len(FRAMES_MAGIC)] != FRAMES_MAGIC:
+            return None
+        bytes_to_recover = int.from_bytes(header[len(FRAMES_MAGIC):], byteorder=sys.byteorder)
+
+        maximum_bytes_in_image = sum(capacities) - header_size
+        if bytes_to_recover > maximum_bytes_in_image:
+            raise ValueError(f"This image appears to be corrupted.\nIt claims to hold {bytes_to_recover} B, "
+                             f"but can only hold {maximum_bytes_in_image} B with {num_lsb} LSBs")
+
+    num_bytes = header_size + bytes_to_recover
+    lock = threading.Lock()
+    recovered = 0
+
+    def recover_from_frame(color_data: np.ndarray, start: int, end: int) -> np.ndarray:
+        nonlocal recovered
+        data = deinterleave_chunks(color_data, end - start, num_lsb, cancel=cancel)
+        with lock:
+            recovered += end - start
+            report(recovered, num_bytes, progress)
+        return data
+
+    with span("Bytes recovered", bytes_to_recover), ThreadPoolExecutor(resolve_workers(workers)) as pool:
+        chunks = []
+        for frame, (start, end) in enumerate(frame_ranges(capacities, num_bytes)):
+            report(recovered, num_bytes, cancel=cancel)
+            color_data = first_frame
+            if frame:
+                input_image.seek(frame)
+                color_data = image_to_array(input_image, writable=False)
+            chunks.append(pool.submit(recover_from_frame, color_data, start, end))
+        data = np.concatenate([chunk.result() for chunk in chunks])
+        return data[header_size:].tobytes()
+
+
+@timed("LSBSteg.recover_data")
+def recover_data(steg_image_path: str, output_file_path: str, num_lsb: int, workers: int = 1,
+                 progress: Optional[ProgressCallback] = None, cancel: Optional[CancelToken] = None) -> None:
     """Writes the data from the steganographed image to the output file"""
     if steg_image_path is None:
         raise ValueError("LSBSteg recovery requires an input image file path")
@@ -143,10 +553,9 @@ def recover_data(steg_image_path: str, output_file_path: str, num_lsb: int) -> N
 
     steg_image, output_file = prepare_recover(steg_image_path, output_file_path)
     with steg_image as steg_image, output_file as output_file:
-        data = recover_message_from_image(steg_image, num_lsb)
-        start = time()
-        output_file.write(data)
-        log.debug(f"{'Output file written':<30} in {time() - start:.2f}s")
+        data = recover_message_from_image(steg_image, num_lsb, workers, progress, cancel)
+        with span("Output file written", len(data)):
+            output_file.write(data)
 
 
 def analysis(image_file_path: str, input_file_path: str, num_lsb: int) -> None:
@@ -155,11 +564,13 @@ def analysis(image_file_path: str, input_file_path: str, num_lsb: int) -> None:
         raise ValueError("LSBSteg analysis requires an input image file path")
 
     with Image.open(image_file_path) as image:
-        num_channels = len(image.getbands())
-        print(f"Image resolution: ({image.size[0]}, {image.size[1]}, {len(image.getbands())})\n"
-              f"{f'Using {num_lsb} LSBs, we can hide:':<30} {max_bits_to_hide(image, num_lsb, num_channels) // 8} B")
+        capacity, file_size_tag_size = image_capacity(image, num_lsb)
+        print(f"Image resolution: ({image.size[0]}, {image.size[1]}, {len(image.getbands())})")
+        if is_multi_frame(image):
+            print(f"{'Frames:':<30} {image.n_frames}")
+        print(f"{f'Using {num_lsb} LSBs, we can hide:':<30} {capacity} B")
 
         if input_file_path is not None:
             print(f"{'Size of input file:':<30} {get_filesize(input_file_path)} B")
 
-        print(f"{'File size tag:':<30} {bytes_in_max_file_size(image, num_lsb, num_channels)} B")
+        print(f"{'File size tag:':<30} {file_size_tag_size} B")
@@ -1,31 +1,36 @@
-from mp3stego import Steganography
+from lazy import lazy_import
+
+__all__ = ["hide_message", "reveal_message", "encode_wav_to_mp3", "decode_mp3_to_wav", "clear_hidden_message"]
+
+# mp3stego is only imported when it is first used
+mp3stego = lazy_import("mp3stego")
 
 
 def hide_message(input_mp3, output_mp3, message):
     """Hide a message in an MP3 file."""
-    stego = Steganography(quiet=True)
+    stego = mp3stego.Steganography(quiet=True)
     stego.hide_message(input_mp3, output_mp3, message)
 
 
 def reveal_message(input_mp3, output_txt):
     """Reveal a hidden message from an MP3 file."""
-    stego = Steganography(quiet=True)
+    stego = mp3stego.Steganography(quiet=True)
     stego.reveal_massage(input_mp3, output_txt)
 
 
 def encode_wav_to_mp3(input_wav, output_mp3, bitrate=320):
     """Encode a WAV file into an MP3 file."""
-    stego = Steganography(quiet=True)
+    stego = mp3stego.Steganography(quiet=True)
     stego.encode_wav_to_mp3(input_wav, output_mp3, bitrate)
 
 
 def decode_mp3_to_wav(input_mp3, output_wav):
     """Decode an MP3 file into a WAV file."""
-    stego = Steganography(quiet=True)
+    stego = mp3stego.Steganography(quiet=True)
     stego.decode_mp3_to_wav(input_mp3, output_wav)
 
 
 def clear_hidden_message(input_mp3, output_mp3):
     """Clear a hidden message from an MP3 file."""
-    stego = Steganography(quiet=True)
+    stego = mp3stego.Steganography(quiet=True)
     stego.clear_file(input_mp3, output_mp3)
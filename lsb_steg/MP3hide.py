@@ -1,60 +1,191 @@
+import mmap
 import os
-from tqdm import tqdm
+import struct
+import zlib
 
-def hide(mp3_file, file_to_hide, output_file):
+from progress import report
+from timing import span, timed
+
+# Marks the start of the hidden data
+DELIMITER = b'--HIDDEN-DATA-START--'
+
+# Fixed-size footer at the very end of the file: magic, offset and length of the hidden data, CRC-32 of the data
+FOOTER = struct.Struct('<8sQQI')
+FOOTER_MAGIC = b'HSMP3FTR'
+
+# Size of the reads used to copy the hidden data out
+CHUNK_SIZE = 1 << 20
+
+# Largest kernel copy, smaller when progress is reported so it is reported often enough
+KERNEL_COPY_SIZE = 1 << 30
+PROGRESS_COPY_SIZE = 1 << 24
+
+
+@timed('MP3hide.hide')
+def hide(mp3_file, file_to_hide, output_file, progress=None, cancel=None):
     if not os.path.exists(mp3_file):
         raise FileNotFoundError(f"MP3 file '{mp3_file}' not found.")
     if not os.path.exists(file_to_hide):
         raise FileNotFoundError(f"File to hide '{file_to_hide}' not found.")
     
-    # Read the MP3 file
-    with open(mp3_file, 'rb') as mp3:
-        mp3_data = mp3.read()
-
-    # Read the file to hide
-    with open(file_to_hide, "rb") as hidden_file:
-        data_to_hide = hidden_file.read()
-
-    # Add a delimiter to mark the start of the hidden data
-    delimiter = b'--HIDDEN-DATA-START--'
-
-    # Append the hidden data to the MP3 file
-    with open(output_file, 'wb') as output:
-        output.write(mp3_data)
-        output.write(delimiter)
-        output.write(data_to_hide)
+    mp3_size = os.path.getsize(mp3_file)
+    hidden_size = os.path.getsize(file_to_hide)
+
+    # Append the hidden data to the MP3 file, after a delimiter marking its start
+    # and followed by a footer so it can be found without scanning the file.
+    # Both inputs are streamed, so memory use doesn't depend on their size.
+    # Progress counts the hidden data twice, as it is read for the checksum first
+    total = mp3_size + 2 * hidden_size
+    with open(mp3_file, 'rb', buffering=0) as mp3, open(file_to_hide, 'rb', buffering=0) as hidden_file, \
+            open(output_file, 'wb', buffering=0) as output:
+        with span('Checksum computed', hidden_size):
+            crc = file_crc(hidden_file, lambda done: report(done, total, progress, cancel))
+        with span('Files copied', mp3_size + hidden_size):
+            copy_file(mp3, output, mp3_size, lambda done: report(hidden_size + done, total, progress, cancel))
+            output.write(DELIMITER)
+            copy_file(hidden_file, output, hidden_size,
+                      lambda done: report(hidden_size + mp3_size + done, total, progress, cancel))
+            output.write(FOOTER.pack(FOOTER_MAGIC, mp3_size + len(DELIMITER), hidden_size, crc))
 
     print(f"File '{file_to_hide}' has been successfully hidden in '{output_file}'.")
 
-def extract(mp3_file, output_file):
+
+def file_crc(source, on_chunk=None):
+    """Return the CRC-32 of the rest of the open file, read in chunks, and seek back to where it started.
+
+    on_chunk, if given, is called with the number of bytes read so far after each chunk."""
+    start = source.tell()
+    crc = 0
+    done = 0
+    for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+        crc = zlib.crc32(chunk, crc)
+        done += len(chunk)
+        if on_chunk is not None:
+            on_chunk(done)
+    source.seek(start)
+    return crc
+
+
+def copy_file(source, destination, length, on_chunk=None):
+    """Copy length bytes from the current position of the unbuffered source to the unbuffered destination.
+
+    The copy is done by the kernel with copy_file_range or sendfile where
+    possible, otherwise the data is copied in chunks. on_chunk, if given, is
+    called with the number of bytes copied so far after each chunk. Raises
+    ValueError if the source ends before length bytes were copied."""
+    source_fd, destination_fd = source.fileno(), destination.fileno()
+    copy_size = KERNEL_COPY_SIZE if on_chunk is None else PROGRESS_COPY_SIZE
+    done = 0
+    kernel_copies = []
+    if hasattr(os, 'copy_file_range'):
+        kernel_copies.append(lambda count: os.copy_file_range(source_fd, destination_fd, count))
+    if hasattr(os, 'sendfile'):
+        kernel_copies.append(lambda count: os.sendfile(destination_fd, source_fd, None, count))
+
+    for kernel_copy in kernel_copies:
+        try:
+            while length > 0:
+                copied = kernel_copy(min(length, copy_size))
+                if copied == 0:
+                    # Nothing more could be copied this way, carry on with the next method
+                    break
+                length -= copied
+                done += copied
+                if on_chunk is not None:
+                    on_chunk(done)
+        except OSError:
+            # Not supported between these files, carry on with the next method
+            pass
+        if length <= 0:
+            return
+
+    while length > 0:
+        chunk = source.read(min(CHUNK_SIZE, length))
+        if not chunk:
+            raise ValueError(f"The file ended {length} bytes before the end of the data to copy.")
+        destination.write(chunk)
+        length -= len(chunk)
+        done += len(chunk)
+        if on_chunk is not None:
+            on_chunk(done)
+
+
+def read_footer(mp3):
+    """Return (offset, length, crc) of the hidden data from the footer of the open file, or None if it has none."""
+    file_size = os.fstat(mp3.fileno()).st_size
+    if file_size < FOOTER.size:
+        return None
+
+    mp3.seek(file_size - FOOTER.size)
+    magic, offset, length, crc = FOOTER.unpack(mp3.read(FOOTER.size))
+    if magic != FOOTER_MAGIC or offset + length + FOOTER.size != file_size:
+        return None
+    return offset, length, crc
+
+
+def find_delimiter(mp3):
+    """Return (offset, length) of data hidden without a footer, which follows the first delimiter, or None."""
+    file_size = os.fstat(mp3.fileno()).st_size
+    if file_size == 0:
+        return None
+
+    # Searching through a memory map reads the file a page at a time rather than all at once.
+    # Older versions split at the first delimiter, so the data may itself contain the delimiter
+    with mmap.mmap(mp3.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        delimiter_index = mapped.find(DELIMITER)
+    if delimiter_index == -1:
+        return None
+    offset = delimiter_index + len(DELIMITER)
+    return offset, file_size - offset
+
+
+def copy_range(source, destination, offset, length, on_chunk=None):
+    """Copy length bytes starting at offset from source to destination in chunks, returning their CRC-32.
+
+    on_chunk, if given, is called with the number of bytes copied so far after each chunk."""
+    crc = 0
+    done = 0
+    source.seek(offset)
+    while done < length:
+        chunk = source.read(min(CHUNK_SIZE, length - done))
+        if not chunk:
+            raise ValueError("The MP3 file ended before the hidden data.")
+        destination.write(chunk)
+        crc = zlib.crc32(chunk, crc)
+        done += len(chunk)
+        if on_chunk is not None:
+            on_chunk(done)
+    return crc
+
+
+@timed('MP3hide.extract')
+def extract(mp3_file, output_file, progress=None, cancel=None):
     if not os.path.exists(mp3_file):
         raise FileNotFoundError(f"MP3 file '{mp3_file}' not found.")
     
-    # Read the MP3 file
     with open(mp3_file, 'rb') as mp3:
-        mp3_data = mp3.read()
-
-    # Find the delimiter that marks the start of the hidden data
-    delimiter = b'--HIDDEN-DATA-START--'
-    delimiter_index = mp3_data.find(delimiter)
-
-    if delimiter_index == -1:
-        raise ValueError("No hidden data found in the MP3 file.")
+        with span('Hidden data located'):
+            # Files written by older versions have no footer
+            footer = read_footer(mp3)
+            location = footer[:2] if footer is not None else find_delimiter(mp3)
+        if location is None:
+            raise ValueError("No hidden data found in the MP3 file.")
 
-    # Extract the hidden data
-    hidden_data = mp3_data[delimiter_index + len(delimiter):]
+        # Stream the hidden data to the output file
+        offset, length = location
+        with span('Hidden data copied', length), open(output_file, "wb") as output:
+            crc = copy_range(mp3, output, offset, length, lambda done: report(done, length, progress, cancel))
 
-    # Write the hidden data to the output file
-    with open(output_file, "wb") as output:
-        output.write(hidden_data)
+    if footer is not None and crc != footer[2]:
+        raise ValueError("The hidden data is corrupted, its checksum doesn't match.")
 
     print(f"Hidden data has been successfully extracted to '{output_file}'.")
 
-def hide_file_in_mp3(mp3_file, file_to_hide, output_file):
-    hide(mp3_file, file_to_hide, output_file)
+def hide_file_in_mp3(mp3_file, file_to_hide, output_file, progress=None, cancel=None):
+    hide(mp3_file, file_to_hide, output_file, progress, cancel)
 
-def reveal_file_from_mp3(mp3_file, output_file):
-    extract(mp3_file, output_file)
+def reveal_file_from_mp3(mp3_file, output_file, progress=None, cancel=None):
+    extract(mp3_file, output_file, progress, cancel)
 
 if __name__ == "__main__":
     import argparse
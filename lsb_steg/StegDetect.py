@@ -12,32 +12,65 @@
 """
 import logging
 import os
-from time import time
-from typing import cast, Tuple, Iterable
+from typing import Optional
 
-from PIL import Image
+import numpy as np
+
+from lazy import lazy_import
+from timing import span, timed
+
+__all__ = ["DEFAULT_TILE_ROWS", "lsb_map", "show_lsb"]
 
 log = logging.getLogger(__name__)
 
+Image = lazy_import("PIL.Image")
+
+# Number of image rows processed at once, which bounds the memory used for very large images
+DEFAULT_TILE_ROWS = 256
+
+
+def lsb_map(color_data: np.ndarray, n: int) -> np.ndarray:
+    """Returns the n least significant bits of each pixel of a (height, width[, bands]) array,
+    summed over its bands and scaled to the range 0-255."""
+    # Used to set everything but the least significant n bits to 0 when
+    # using bitwise AND on an integer
+    mask = (1 << n) - 1
+    color_data = color_data.reshape(color_data.shape[0], color_data.shape[1], -1)
+    lsb_sum = (color_data & mask).sum(axis=2, dtype=np.uint32)
+    return (255 * lsb_sum // (color_data.shape[2] * mask)).astype(np.uint8)
 
-def show_lsb(image_path: str, n: int) -> None:
-    """Shows the n least significant bits of image"""
+
+@timed("StegDetect.show_lsb")
+def show_lsb(image_path: str, n: int, tile_rows: int = DEFAULT_TILE_ROWS, output_path: Optional[str] = None) -> None:
+    """Shows the n least significant bits of image
+
+    The image is processed tile_rows rows at a time. Single band images give a
+    grayscale map, anything else an RGB image with the map in every channel.
+    It is saved to output_path, by default next to the image with "_nLSBs" appended."""
     if image_path is None:
         raise ValueError("StegDetect requires an input image file path")
+    if not 1 <= n <= 8:
+        raise ValueError("StegDetect can show between 1 and 8 LSBs")
+
+    with Image.open(image_path) as image, span("LSBs mapped") as map_span:
+        width, height = image.size
+        mode = "L" if len(image.getbands()) == 1 else "RGB"
+        lsb_image = Image.new(mode, image.size)
+
+        for top in range(0, height, tile_rows):
+            bottom = min(top + tile_rows, height)
+            tile = np.asarray(image.crop((0, top, width, bottom)))
+            if tile.dtype != np.uint8:
+                raise ValueError(f"Images in mode {image.mode} are not supported, only 8 bits per channel")
+
+            tile_map = lsb_map(tile, n)
+            if mode == "RGB":
+                tile_map = np.repeat(tile_map[:, :, np.newaxis], 3, axis=2)
+            lsb_image.paste(Image.frombuffer(mode, (width, bottom - top), tile_map, "raw", mode, 0, 1), (0, top))
+            map_span.nbytes = (map_span.nbytes or 0) + tile.nbytes
 
-    start = time()
-    with Image.open(image_path) as image:
-        # Used to set everything but the least significant n bits to 0 when
-        # using bitwise AND on an integer
-        mask = (1 << n) - 1
-
-        image_data = cast(Iterable[Tuple[int, int, int]], image.getdata())
-        color_data = [
-            (255 * ((rgb[0] & mask) + (rgb[1] & mask) + (rgb[2] & mask)) // (3 * mask),) * 3
-            for rgb in image_data
-        ]
-
-        image.putdata(color_data)
-        log.debug(f"Runtime: {time() - start:.2f}s")
-        file_name, file_extension = os.path.splitext(image_path)
-        image.save(f"{file_name}_{n}LSBs{file_extension}")
+    with span("Image saved"):
+        if output_path is None:
+            file_name, file_extension = os.path.splitext(image_path)
+            output_path = f"{file_name}_{n}LSBs{file_extension}"
+        lsb_image.save(output_path)
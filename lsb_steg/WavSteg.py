@@ -1,17 +1,189 @@
-
 import logging
 import math
 import os
+import struct
 import wave
-from time import time
+from typing import IO, Iterator, Optional, Tuple
+
+from bit_manipulation import lsb_deinterleave_bytes, lsb_interleave_bytes, roundup
+from inplace import clone_file, map_bytes
+from progress import CancelToken, ProgressCallback, report
+from timing import span, timed
 
-from bit_manipulation import lsb_deinterleave_bytes, lsb_interleave_bytes
+__all__ = [
+    "DEFAULT_CHUNK_FRAMES", "HEADER", "HEADER_MAGIC", "HEADER_VERSION", "HEADER_LSB", "block_frames", "header_frames",
+    "make_header", "read_header", "data_chunk_offset", "hide_in_place", "write_frames", "hide_blocks", "recover_blocks",
+    "prepare_header", "hide_data", "recovery_params", "recover_data",
+]
 
 log = logging.getLogger(__name__)
 
+# Default number of frames read, interleaved and written at once when streaming
+DEFAULT_CHUNK_FRAMES = 1 << 16
+
+# Header hidden at the start of the samples: magic, version, num_lsb, flags and payload length.
+# It always uses HEADER_LSB LSBs, so it can be read before num_lsb is known.
+HEADER = struct.Struct("<4sBBBQ")
+HEADER_MAGIC = b"HSWS"
+HEADER_VERSION = 1
+HEADER_LSB = 1
+
+
+def block_frames(num_channels: int, chunk_frames: int) -> int:
+    """Rounds chunk_frames down so that a block of frames holds a whole number of payload bytes."""
+    # A multiple of 8 samples holds a whole number of bytes for any number of LSBs
+    step = 8 // math.gcd(8, num_channels)
+    return max(step, chunk_frames // step * step)
+
+
+def header_frames(num_channels: int) -> int:
+    """Returns the number of frames reserved for the header, the payload starts right after them."""
+    return math.ceil(8 * HEADER.size / HEADER_LSB / num_channels)
+
+
+def make_header(num_bytes: int, num_lsb: int, flags: int = 0) -> bytes:
+    """Returns the header for a payload of num_bytes bytes hidden with num_lsb LSBs."""
+    return HEADER.pack(HEADER_MAGIC, HEADER_VERSION, num_lsb, flags, num_bytes)
+
+
+def read_header(sound: wave.Wave_read) -> Optional[Tuple[int, int, int]]:
+    """Reads the header frames of sound and returns (num_lsb, flags, num_bytes), or None if
+    the sound file has no header, in which case the read position is rewound."""
+    header_bytes = lsb_deinterleave_bytes(sound.readframes(header_frames(sound.getnchannels())), 8 * HEADER.size,
+                                          HEADER_LSB, byte_depth=sound.getsampwidth())
+    magic, version, num_lsb, flags, num_bytes = HEADER.unpack(header_bytes)
+    if magic != HEADER_MAGIC or version != HEADER_VERSION or not 1 <= num_lsb <= 8 * sound.getsampwidth():
+        sound.rewind()
+        return None
+    return num_lsb, flags, num_bytes
+
+
+def data_chunk_offset(sound_path: str) -> int:
+    """Returns the offset in bytes of the sample data in the data chunk of the wav file at sound_path."""
+    with open(sound_path, "rb") as sound:
+        riff, _, wave_id = struct.unpack("<4sI4s", sound.read(12))
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            raise ValueError("File is not a RIFF WAVE file")
+        while True:
+            chunk_header = sound.read(8)
+            if len(chunk_header) < 8:
+                raise ValueError("File has no data chunk")
+            chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+            if chunk_id == b"data":
+                return sound.tell()
+            # chunks are padded to an even number of bytes
+            sound.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+
+def hide_in_place(output_path: str, data: bytes, num_lsb: int, sample_width: int, workers: int = 1,
+                  offset: int = 0) -> None:
+    """Hides data in the samples of the wav file at output_path starting offset bytes into the
+    sample data, rewriting only the bytes which hold it."""
+    bit_height = roundup(8 * len(data) / num_lsb)
+    with map_bytes(output_path, data_chunk_offset(output_path) + offset, bit_height * sample_width) as samples:
+        lsb_interleave_bytes(samples, data, num_lsb, truncate=True, byte_depth=sample_width, workers=workers,
+                             out=samples)
+
+
+def write_frames(sound_steg: wave.Wave_write, sound_frames: bytes, data: bytes, num_lsb: int, sample_width: int,
+                 workers: int = 1) -> None:
+    """Writes sound_frames to sound_steg with data hidden in them, without copying the frames which don't hold data."""
+    hidden = lsb_interleave_bytes(sound_frames, data, num_lsb, truncate=True, byte_depth=sample_width,
+                                  workers=workers)
+    sound_steg.writeframesraw(hidden)
+    sound_steg.writeframesraw(memoryview(sound_frames)[len(hidden):])
+
+
+def hide_blocks(sound: wave.Wave_read, sound_steg: wave.Wave_write, file: IO[bytes], num_lsb: int,
+                chunk_frames: int = DEFAULT_CHUNK_FRAMES, workers: int = 1,
+                header: Optional[bytes] = None) -> Iterator[int]:
+    """Copies sound to sound_steg one block of frames at a time, hiding header (if given) in
+    the header frames and the contents of file in the following blocks. Yields the number of
+    sound bytes written after each block."""
+    sample_width = sound.getsampwidth()
+    frames_per_block = block_frames(sound.getnchannels(), chunk_frames)
+    payload_per_block = frames_per_block * sound.getnchannels() * num_lsb // 8
+
+    written = 0
+    if header is not None:
+        sound_frames = sound.readframes(header_frames(sound.getnchannels()))
+        write_frames(sound_steg, sound_frames, header, HEADER_LSB, sample_width)
+        written += len(sound_frames)
+
+    payload = file.read(payload_per_block)
+    while True:
+        sound_frames = sound.readframes(frames_per_block)
+        if not sound_frames:
+            break
+        if payload:
+            write_frames(sound_steg, sound_frames, payload, num_lsb, sample_width, workers)
+            payload = file.read(payload_per_block)
+        else:
+            sound_steg.writeframesraw(sound_frames)
+        written += len(sound_frames)
+        yield written
 
-def hide_data(sound_path: str, file_path: str, output_path: str, num_lsb: int) -> None:
-    """Hide data from the file at file_path in the sound file at sound_path"""
+
+def recover_blocks(sound: wave.Wave_read, output_file: IO[bytes], num_lsb: int, bytes_to_recover: int,
+                   chunk_frames: int = DEFAULT_CHUNK_FRAMES, workers: int = 1) -> Iterator[int]:
+    """Recovers bytes_to_recover bytes from sound into output_file one block of frames at a time.
+    Yields the number of bytes recovered after each block."""
+    sample_width = sound.getsampwidth()
+    frames_per_block = block_frames(sound.getnchannels(), chunk_frames)
+    payload_per_block = frames_per_block * sound.getnchannels() * num_lsb // 8
+
+    recovered = 0
+    while recovered < bytes_to_recover:
+        sound_frames = sound.readframes(frames_per_block)
+        if not sound_frames:
+            break
+        num_bytes = min(bytes_to_recover - recovered, payload_per_block)
+        output_file.write(lsb_deinterleave_bytes(sound_frames, 8 * num_bytes, num_lsb, byte_depth=sample_width,
+                                                 workers=workers))
+        recovered += num_bytes
+        yield recovered
+
+
+def prepare_header(sound: wave.Wave_read, file_size: int, num_lsb: int, header: bool = True) -> Optional[bytes]:
+    """Checks that file_size bytes fit in sound with num_lsb LSBs, after the header unless header
+    is False, raising ValueError if they don't. Returns the header to hide, if any."""
+    num_channels = sound.getnchannels()
+    sample_width = sound.getsampwidth()
+    num_header_frames = header_frames(num_channels) if header else 0
+    num_samples = (sound.getnframes() - num_header_frames) * num_channels
+
+    # We can hide up to num_lsb bits in each sample of the sound file after the header
+    max_bytes_to_hide = max(0, num_samples * num_lsb) // 8
+
+    log.debug(f"Using {num_lsb} LSBs, we can hide {max_bytes_to_hide} bytes")
+
+    if file_size > max_bytes_to_hide:
+        if num_samples <= 0:
+            raise ValueError("Sound file is too short to hold a WavSteg header")
+        required_lsb = math.ceil(file_size * 8 / num_samples)
+        raise ValueError(f"Input file too large to hide, requires {required_lsb} LSBs, using {num_lsb}")
+
+    if sample_width < 1 or sample_width > 4:
+        # WavSteg doesn't support higher sample widths, see setsampwidth() in cpython/Libwave.py
+        raise ValueError("File has an unsupported bit-depth")
+
+    return make_header(file_size, num_lsb) if header else None
+
+
+@timed("WavSteg.hide_data")
+def hide_data(sound_path: str, file_path: str, output_path: str, num_lsb: int,
+              chunk_frames: Optional[int] = None, in_place: bool = False, workers: int = 1,
+              header: bool = True, progress: Optional[ProgressCallback] = None,
+              cancel: Optional[CancelToken] = None) -> None:
+    """Hide data from the file at file_path in the sound file at sound_path
+
+    Unless header is False, a header holding the size of the data and num_lsb is
+    hidden before it, so it can be recovered without knowing either. If chunk_frames
+    is given, the sound and secret files are streamed chunk_frames frames at a time
+    instead of being read into memory. If in_place is True, the sound file is copied
+    to output_path and only the samples holding the data are rewritten, through a
+    memory map. workers is the number of threads to interleave with, < 1 for one per core.
+    progress and cancel are called and checked after each block when streaming, see progress.py."""
     if sound_path is None:
         raise ValueError("WavSteg hiding requires an input sound file path")
     if file_path is None:
@@ -24,65 +196,112 @@ def hide_data(sound_path: str, file_path: str, output_path: str, num_lsb: int) -
         num_channels = sound.getnchannels()
         sample_width = sound.getsampwidth()
         num_frames = sound.getnframes()
-        num_samples = num_frames * num_channels
-
-        # We can hide up to num_lsb bits in each sample of the sound file
-        max_bytes_to_hide = (num_samples * num_lsb) // 8
         file_size = os.stat(file_path).st_size
 
-        log.debug(f"Using {num_lsb} LSBs, we can hide {max_bytes_to_hide} bytes")
+        header_bytes = prepare_header(sound, file_size, num_lsb, header)
+        header_size = (header_frames(num_channels) if header else 0) * num_channels * sample_width
 
-        start = time()
-        sound_frames = sound.readframes(num_frames)
-        with open(file_path, "rb") as file:
-            data = file.read()
-        log.debug(f"{'Files read':<30} in {time() - start:.2f}s")
+        if in_place:
+            with span("Sound file copied"):
+                clone_file(sound_path, output_path)
 
-        if file_size > max_bytes_to_hide:
-            required_lsb = math.ceil(file_size * 8 / num_samples)
-            raise ValueError(f"Input file too large to hide, requires {required_lsb} LSBs, using {num_lsb}")
+            with span("Bytes hidden", file_size):
+                with open(file_path, "rb") as file:
+                    data = file.read()
+                if header_bytes is not None:
+                    hide_in_place(output_path, header_bytes, HEADER_LSB, sample_width)
+                hide_in_place(output_path, data, num_lsb, sample_width, workers, offset=header_size)
+            report(file_size, file_size, progress)
+            return
 
-        if sample_width < 1 or sample_width > 4:
-            # WavSteg doesn't support higher sample widths, see setsampwidth() in cpython/Libwave.py
-            raise ValueError("File has an unsupported bit-depth")
+        if chunk_frames is not None:
+            with span("Bytes hidden and written", file_size), open(file_path, "rb") as file, \
+                    wave.open(output_path, "w") as sound_steg:
+                sound_steg.setparams(params)
+                sound_size = num_frames * num_channels * sample_width
+                for written in hide_blocks(sound, sound_steg, file, num_lsb, chunk_frames, workers, header_bytes):
+                    report(written, sound_size, progress, cancel)
+            return
 
-        start = time()
-        sound_frames = lsb_interleave_bytes(sound_frames, data, num_lsb, byte_depth=sample_width)
-        log.debug(f"{f'{file_size} bytes hidden':<30} in {time() - start:.2f}s")
+        with span("Files read"):
+            sound_frames = memoryview(sound.readframes(num_frames))
+            with open(file_path, "rb") as file:
+                data = file.read()
 
-        start = time()
-        with wave.open(output_path, "w") as sound_steg:
+        with span("Bytes hidden and written", file_size), wave.open(output_path, "w") as sound_steg:
             sound_steg.setparams(params)
-            sound_steg.writeframes(sound_frames)
-        log.debug(f"{'Output wav written':<30} in {time() - start:.2f}s")
+            if header_bytes is not None:
+                write_frames(sound_steg, sound_frames[:header_size], header_bytes, HEADER_LSB, sample_width)
+            write_frames(sound_steg, sound_frames[header_size:], data, num_lsb, sample_width, workers)
+        report(file_size, file_size, progress)
+
+
+def recovery_params(sound: wave.Wave_read, num_lsb: Optional[int],
+                    bytes_to_recover: Optional[int]) -> Tuple[int, int]:
+    """Returns the number of LSBs used and of bytes hidden in sound, from its header if it has one,
+    otherwise the given values, which are then required. Leaves sound at the first frame of the data."""
+    if sound.getsampwidth() < 1 or sound.getsampwidth() > 4:
+        # WavSteg doesn't support higher sample widths, see setsampwidth() in cpython/Libwave.py
+        raise ValueError("File has an unsupported bit-depth")
 
+    num_channels = sound.getnchannels()
+    header = read_header(sound) if sound.getnframes() >= header_frames(num_channels) else None
+    if header is not None:
+        header_lsb, _, header_bytes = header
+        if num_lsb is not None and num_lsb != header_lsb:
+            log.debug(f"Header says {header_lsb} LSBs were used, ignoring {num_lsb}")
+        if bytes_to_recover is not None and bytes_to_recover != header_bytes:
+            log.debug(f"Header says {header_bytes} bytes were hidden, ignoring {bytes_to_recover}")
+        num_lsb, bytes_to_recover = header_lsb, header_bytes
 
-def recover_data(sound_path: str, output_path: str, num_lsb: int, bytes_to_recover: int) -> None:
-    """Recover data from the file at sound_path to the file at output_path"""
+        max_bytes_to_recover = (sound.getnframes() - header_frames(num_channels)) * num_channels * num_lsb // 8
+        if bytes_to_recover > max_bytes_to_recover:
+            raise ValueError(f"This sound file appears to be corrupted.\nIt claims to hold {bytes_to_recover} B, "
+                             f"but can only hold {max_bytes_to_recover} B with {num_lsb} LSBs")
+    elif bytes_to_recover is None or num_lsb is None:
+        raise ValueError("No WavSteg header found, recovery requires the number of LSBs and bytes to recover")
+    return num_lsb, bytes_to_recover
+
+
+@timed("WavSteg.recover_data")
+def recover_data(sound_path: str, output_path: str, num_lsb: Optional[int] = None,
+                 bytes_to_recover: Optional[int] = None, chunk_frames: Optional[int] = None,
+                 workers: int = 1, progress: Optional[ProgressCallback] = None,
+                 cancel: Optional[CancelToken] = None) -> None:
+    """Recover data from the file at sound_path to the file at output_path
+
+    If the sound file has a WavSteg header, the number of bytes to recover and
+    the number of LSBs are read from it. Otherwise both must be given. Only the
+    frames which hold the data are read. If chunk_frames is given, they are
+    streamed chunk_frames frames at a time instead of being read at once.
+    workers is the number of threads to deinterleave with, < 1 for one per core.
+    progress and cancel are called and checked after each block when streaming, see progress.py."""
     if sound_path is None:
         raise ValueError("WavSteg recovery requires an input sound file path")
     if output_path is None:
         raise ValueError("WavSteg recovery requires an output file path")
-    if bytes_to_recover is None:
-        raise ValueError("WavSteg recovery requires the number of bytes to recover")
 
-    start = time()
     with wave.open(sound_path, "r") as sound:
-        # num_channels = sound.getnchannels()
         sample_width = sound.getsampwidth()
-        num_frames = sound.getnframes()
-        sound_frames = sound.readframes(num_frames)
-        log.debug(f"{'Files read':<30} in {time() - start:.2f}s")
+        with span("Header read"):
+            num_lsb, bytes_to_recover = recovery_params(sound, num_lsb, bytes_to_recover)
+
+        if chunk_frames is not None:
+            with span("Bytes recovered", bytes_to_recover), open(output_path, "wb+") as output_file:
+                for recovered in recover_blocks(sound, output_file, num_lsb, bytes_to_recover, chunk_frames,
+                                                workers):
+                    report(recovered, bytes_to_recover, progress, cancel)
+            return
 
-        if sample_width < 1 or sample_width > 4:
-            # WavSteg doesn't support higher sample widths, see setsampwidth() in cpython/Libwave.py
-            raise ValueError("File has an unsupported bit-depth")
+        with span("Files read"):
+            # only read the frames which hold the data
+            sound_frames = sound.readframes(
+                math.ceil(roundup(8 * bytes_to_recover / num_lsb) / sound.getnchannels()))
 
-        start = time()
-        data = lsb_deinterleave_bytes(sound_frames, 8 * bytes_to_recover, num_lsb, byte_depth=sample_width)
-        log.debug(f"{f'Recovered {bytes_to_recover} bytes':<30} in {time() - start:.2f}s")
+        with span("Bytes recovered", bytes_to_recover):
+            data = lsb_deinterleave_bytes(sound_frames, 8 * bytes_to_recover, num_lsb, byte_depth=sample_width,
+                                          workers=workers)
 
-        start = time()
-        with open(output_path, "wb+") as output_file:
+        with span("Output file written", bytes_to_recover), open(output_path, "wb+") as output_file:
             output_file.write(bytes(data))
-        log.debug(f"{'Written output file':<30} in {time() - start:.2f}s")
+        report(bytes_to_recover, bytes_to_recover, progress)
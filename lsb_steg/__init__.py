@@ -1,5 +1,41 @@
-from .LSBSteg import *
-from .StegDetect import *
-from .WavSteg import *
-from .bit_manipulation import *
-from .MP3Steg import *
+import importlib
+import os
+import re
+from typing import Any, List
+
+# Modules whose names, listed in their __all__, are the package's. Modules are
+# only imported when one of their names is first used, so importing the package
+# stays cheap. Where modules share a name (hide_data, recover_data), the later
+# module's wins.
+_MODULES = ("LSBSteg", "StegDetect", "WavSteg", "bit_manipulation", "MP3Steg", "aio", "serve")
+
+
+def _read_all(module: str) -> List[str]:
+    """Returns the __all__ of module, read from its source so that the module isn't imported."""
+    with open(os.path.join(os.path.dirname(__file__), f"{module}.py"), encoding="utf-8") as source:
+        match = re.search(r"^__all__ = \[(.*?)\]", source.read(), re.MULTILINE | re.DOTALL)
+    if match is None:
+        raise ImportError(f"{module} doesn't list its names in __all__")
+    return re.findall(r'"(\w+)"', match.group(1))
+
+
+_EXPORTS = {module: _read_all(module) for module in _MODULES}
+_MODULE_OF = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = list(_MODULE_OF)
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _MODULE_OF:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = _MODULE_OF[name]
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    # importing a module binds it to its name in the package, which may be one of the package's names (serve)
+    if module in _MODULE_OF:
+        globals().pop(module, None)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(list(globals()) + __all__)
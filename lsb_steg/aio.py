@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+    hide_stream.aio
+    ~~~~~~~~~~~~~~~
+
+    Coroutine versions of the hiding, recovery and analysis entry points,
+    for use from asyncio services. File I/O and the NumPy and PIL work run
+    on a bounded thread pool, so the event loop is never blocked.
+
+    Carriers and secrets may be paths, bytes, binary files or asyncio
+    streams (anything with a coroutine read(), such as aiohttp's
+    StreamReader). Outputs may be paths, binary files or asyncio writers;
+    when no output is given, the result is returned as bytes.
+
+    A cancelled task stops at the next chunk: the call running on the pool
+    when it is cancelled can't be interrupted, so it is waited for before
+    the files it uses are closed. Sound files are processed in blocks of
+    chunk_frames frames, images in a few steps (decode, hide, encode).
+
+    :copyright: (c) 2015 by R433.
+    :license: MIT License, see LICENSE.md for more details.
+"""
+import asyncio
+import contextlib
+import contextvars
+import functools
+import inspect
+import io
+import os
+import wave
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Any, Callable, Dict, Iterator, Optional, Protocol, Tuple, Union
+
+import LSBSteg
+import WavSteg
+import reverse_entropy
+
+__all__ = [
+    "AsyncReader", "AsyncWriter", "Source", "Sink", "DEFAULT_MAX_WORKERS", "set_max_workers", "get_executor", "run",
+    "run_blocks", "read_source", "open_source", "write_sink", "open_sink", "finish_sink", "hide_image", "recover_image",
+    "hide_wav", "recover_wav", "capacity", "detect",
+]
+
+
+class AsyncReader(Protocol):
+    async def read(self, n: int = -1) -> bytes:
+        ...
+
+
+class AsyncWriter(Protocol):
+    async def write(self, data: bytes) -> Any:
+        ...
+
+
+Source = Union[str, os.PathLike, bytes, bytearray, memoryview, IO[bytes], AsyncReader]
+Sink = Union[str, os.PathLike, IO[bytes], AsyncWriter, asyncio.StreamWriter]
+
+# Calls run on the pool at once, per event loop
+DEFAULT_MAX_WORKERS = os.cpu_count() or 1
+
+_max_workers = DEFAULT_MAX_WORKERS
+_executor: Optional[ThreadPoolExecutor] = None
+_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def set_max_workers(max_workers: int) -> None:
+    """Sets the number of threads of the pool, and of calls each event loop may run on it at once."""
+    global _executor, _max_workers
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1")
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+    _executor = None
+    _max_workers = max_workers
+    _slots.clear()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(_max_workers, thread_name_prefix="hide_stream-aio")
+    return _executor
+
+
+async def run(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Runs func(*args, **kwargs) on the pool once a slot is free, in a copy of the current context
+    so that timing spans nest under the caller's.
+
+    If the task is cancelled, the call is waited for before CancelledError is raised."""
+    loop = asyncio.get_running_loop()
+    slots = _slots.get(loop)
+    if slots is None:
+        slots = _slots[loop] = asyncio.Semaphore(_max_workers)
+
+    async with slots:
+        context = contextvars.copy_context()
+        future = loop.run_in_executor(get_executor(), functools.partial(context.run, func, *args, **kwargs))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await asyncio.wait([future])
+            raise
+
+
+async def run_blocks(blocks: Iterator[Any]) -> None:
+    """Runs a block generator such as WavSteg.hide_blocks to the end, one block per call on the pool,
+    so the task can be cancelled between blocks."""
+    while await run(next, blocks, None) is not None:
+        pass
+
+
+def _is_path(value: Any) -> bool:
+    return isinstance(value, (str, os.PathLike))
+
+
+def _is_async(stream: Any, method: str) -> bool:
+    return inspect.iscoroutinefunction(getattr(stream, method, None))
+
+
+def _read_file(path: Union[str, os.PathLike]) -> bytes:
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def _write_file(path: Union[str, os.PathLike], data: bytes) -> None:
+    with open(path, "wb") as file:
+        file.write(data)
+
+
+def _remaining_size(file: IO[bytes]) -> int:
+    position = file.tell()
+    size = file.seek(0, os.SEEK_END)
+    file.seek(position)
+    return size - position
+
+
+async def read_source(source: Source) -> bytes:
+    """Returns the whole contents of source."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    if _is_path(source):
+        return await run(_read_file, source)
+    if _is_async(source, "read"):
+        return await source.read()
+    return await run(source.read)
+
+
+async def open_source(stack: contextlib.AsyncExitStack, source: Source) -> IO[bytes]:
+    """Returns a seekable binary file reading source, closed with stack if it is opened here.
+    Asyncio streams are read into memory first."""
+    if _is_path(source):
+        file = await run(open, source, "rb")
+        stack.push_async_callback(run, file.close)
+        return file
+    if isinstance(source, (bytes, bytearray, memoryview)) or _is_async(source, "read"):
+        return io.BytesIO(await read_source(source))
+    return source
+
+
+async def write_sink(sink: Optional[Sink], data: bytes) -> Optional[bytes]:
+    """Writes data to sink, or returns it if sink is None."""
+    if sink is None:
+        return data
+    if _is_path(sink):
+        await run(_write_file, sink, data)
+    elif hasattr(sink, "drain"):
+        # asyncio.StreamWriter, whose write only buffers
+        sink.write(data)
+        await sink.drain()
+    elif _is_async(sink, "write"):
+        await sink.write(data)
+    else:
+        await run(sink.write, data)
+    return None
+
+
+async def open_sink(stack: contextlib.AsyncExitStack, sink: Optional[Sink]) -> IO[bytes]:
+    """Returns a binary file to write the output for sink to, see finish_sink."""
+    if _is_path(sink):
+        file = await run(open, sink, "wb")
+        stack.push_async_callback(run, file.close)
+        return file
+    if sink is None or hasattr(sink, "drain") or _is_async(sink, "write"):
+        return io.BytesIO()
+    return sink
+
+
+async def finish_sink(sink: Optional[Sink], file: IO[bytes]) -> Optional[bytes]:
+    """Passes on what was written to the file returned by open_sink, returning it if sink is None."""
+    if isinstance(file, io.BytesIO) and file is not sink:
+        return await write_sink(sink, file.getvalue())
+    return None
+
+
+async def hide_image(image: Source, secret: Source, output: Optional[Sink] = None, num_lsb: int = 2,
+                     compression_level: int = 1, image_format: Optional[str] = None,
+                     workers: int = 1) -> Optional[bytes]:
+    """Coroutine version of LSBSteg.hide_data, returning the image holding the secret if output is None.
+
+    image_format defaults to the format given by the extension of an output path, PNG otherwise.
+    The message is hidden across the frames of animated PNGs and multi-page TIFFs, see LSBSteg.is_multi_frame."""
+    async with contextlib.AsyncExitStack() as stack:
+        image_file = await open_source(stack, image)
+        message = await read_source(secret)
+        input_image = await run(LSBSteg.Image.open, image_file)
+        stack.push_async_callback(run, input_image.close)
+
+        if LSBSteg.is_multi_frame(input_image):
+            if image_format is None:
+                image_format = LSBSteg.frames_format(os.fspath(output)) if _is_path(output) else "PNG"
+            frames = await run(LSBSteg.hide_message_in_frames, input_image, message, num_lsb, workers=workers)
+            if _is_path(output):
+                await run(LSBSteg.save_frames, frames, output, image_format, compression_level)
+                return None
+            buffer = io.BytesIO()
+            await run(LSBSteg.save_frames, frames, buffer, image_format, compression_level)
+            return await write_sink(output, buffer.getvalue())
+
+        steg_image = await run(LSBSteg.hide_message_in_image, input_image, message, num_lsb, workers=workers)
+        append_images = await run(LSBSteg.later_frames, input_image)
+        save = functools.partial(steg_image.save, compress_level=compression_level, save_all=bool(append_images),
+                                 append_images=append_images)
+        if _is_path(output):
+            await run(save, output, image_format)
+            return None
+        buffer = io.BytesIO()
+        await run(save, buffer, image_format or "PNG")
+        return await write_sink(output, buffer.getvalue())
+
+
+async def recover_image(image: Source, output: Optional[Sink] = None, num_lsb: int = 2,
+                        workers: int = 1) -> Optional[bytes]:
+    """Coroutine version of LSBSteg.recover_data, returning the data if output is None."""
+    async with contextlib.AsyncExitStack() as stack:
+        image_file = await open_source(stack, image)
+        steg_image = await run(LSBSteg.Image.open, image_file)
+        stack.push_async_callback(run, steg_image.close)
+        data = await run(LSBSteg.recover_message_from_image, steg_image, num_lsb, workers)
+        return await write_sink(output, data)
+
+
+async def hide_wav(sound: Source, secret: Source, output: Optional[Sink] = None, num_lsb: int = 2,
+                   chunk_frames: int = WavSteg.DEFAULT_CHUNK_FRAMES, workers: int = 1,
+                   header: bool = True) -> Optional[bytes]:
+    """Coroutine version of WavSteg.hide_data, returning the sound file holding the secret if output is None.
+
+    The sound is processed chunk_frames frames at a time. Unless output is a path
+    or a binary file, the output is built in memory before it is written."""
+    async with contextlib.AsyncExitStack() as stack:
+        sound_file = await open_source(stack, sound)
+        secret_file = await open_source(stack, secret)
+        file_size = await run(_remaining_size, secret_file)
+
+        sound_in = await run(wave.open, sound_file, "rb")
+        stack.push_async_callback(run, sound_in.close)
+        header_bytes = await run(WavSteg.prepare_header, sound_in, file_size, num_lsb, header)
+
+        output_file = await open_sink(stack, output)
+        sound_steg = await run(wave.open, output_file, "wb")
+        try:
+            sound_steg.setparams(sound_in.getparams())
+            await run_blocks(WavSteg.hide_blocks(sound_in, sound_steg, secret_file, num_lsb, chunk_frames, workers,
+                                                 header_bytes))
+        finally:
+            await run(sound_steg.close)
+        return await finish_sink(output, output_file)
+
+
+async def recover_wav(sound: Source, output: Optional[Sink] = None, num_lsb: Optional[int] = None,
+                      bytes_to_recover: Optional[int] = None, chunk_frames: int = WavSteg.DEFAULT_CHUNK_FRAMES,
+                      workers: int = 1) -> Optional[bytes]:
+    """Coroutine version of WavSteg.recover_data, returning the data if output is None.
+
+    The frames holding the data are processed chunk_frames frames at a time."""
+    async with contextlib.AsyncExitStack() as stack:
+        sound_file = await open_source(stack, sound)
+        sound_in = await run(wave.open, sound_file, "rb")
+        stack.push_async_callback(run, sound_in.close)
+        num_lsb, bytes_to_recover = await run(WavSteg.recovery_params, sound_in, num_lsb, bytes_to_recover)
+
+        output_file = await open_sink(stack, output)
+        await run_blocks(WavSteg.recover_blocks(sound_in, output_file, num_lsb, bytes_to_recover, chunk_frames,
+                                                workers))
+        return await finish_sink(output, output_file)
+
+
+def _capacity(image_file: IO[bytes], num_lsb: int) -> Dict[str, int]:
+    with LSBSteg.Image.open(image_file) as image:
+        capacity, size_tag = LSBSteg.image_capacity(image, num_lsb)
+        return {
+            "width": image.size[0],
+            "height": image.size[1],
+            "channels": len(image.getbands()),
+            "frames": image.n_frames if LSBSteg.is_multi_frame(image) else 1,
+            "capacity": capacity,
+            "size_tag": size_tag,
+        }
+
+
+async def capacity(image: Source, num_lsb: int = 2) -> Dict[str, int]:
+    """Coroutine version of LSBSteg.analysis, returning the image's size, channels and frames, the number
+    of bytes it can hold with num_lsb LSBs and the size of the size tag instead of printing them."""
+    async with contextlib.AsyncExitStack() as stack:
+        return await run(_capacity, await open_source(stack, image), num_lsb)
+
+
+async def detect(image: Source, block_size: Tuple[int, int] = (8, 8)) -> reverse_entropy.EntropyScan:
+    """Coroutine version of reverse_entropy.scan."""
+    async with contextlib.AsyncExitStack() as stack:
+        return await run(reverse_entropy.scan, await open_source(stack, image), block_size)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+    hide_stream.batch
+    ~~~~~~~~~~~~~~~~~
+
+    Runs manifests of hiding, recovery and detection jobs for images, sound
+    files and MP3s on a pool of worker processes, which stay alive between jobs so
+    the codecs are only imported once per worker.
+
+    A job is a dict with the keys:
+
+        op           "hide", "recover" or "detect" (the analysis of :func:`stegscan.analyse`, images only)
+        input        path to the carrier, or to the file holding the data when recovering
+        output       path to write the carrier holding the data, or the recovered data, to, not used by "detect"
+        secret       path to the file to hide, only for "hide"
+        format       "image", "wav" or "mp3", guessed from the input's extension if missing
+        lsb          how many LSBs to use, defaults to 2 (read from the header for wav recovery),
+                     "detect" saves an image of this many LSBs if given
+        compression  PNG compression level for images, defaults to 1
+        bytes        how many bytes to recover from a wav file hidden without a header
+        block_size   size of the square blocks of the entropy analysis of "detect", defaults to 8
+        id           an identifier copied to the job's result, defaults to its line in the manifest
+
+    :copyright: (c) 2015 by R433.
+    :license: MIT License, see LICENSE.md for more details.
+"""
+import contextlib
+import csv
+import errno
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import LSBSteg
+import MP3hide
+import WavSteg
+import stegscan
+from bit_manipulation import lsb_deinterleave_bytes, lsb_interleave_bytes
+
+log = logging.getLogger(__name__)
+
+DEFAULT_LSB = 2
+
+# Job fields holding integers, which CSV manifests give as strings
+INT_FIELDS = ("lsb", "compression", "bytes", "block_size")
+
+# I/O errors which may pass (interrupted or timed out calls, busy or exhausted resources, flaky network
+# filesystems). The rest, such as missing files or permissions, bad jobs or payloads too large, fail every time
+RETRYABLE_ERRORS = (BlockingIOError, InterruptedError, TimeoutError)
+RETRYABLE_ERRNOS = {errno.EAGAIN, errno.EBUSY, errno.EINTR, errno.EIO, errno.EMFILE, errno.ENFILE, errno.ENOMEM,
+                    errno.ETIMEDOUT, getattr(errno, "ESTALE", errno.EIO)}
+
+
+def read_manifest(path: str) -> List[Dict[str, Any]]:
+    """Returns the jobs in the manifest at path, a CSV file with a header row if it ends in .csv,
+    JSON lines otherwise. Jobs without an id get their line number."""
+    with open(path, newline="") as manifest:
+        if path.lower().endswith(".csv"):
+            jobs = [{k: v for k, v in row.items() if v not in (None, "")} for row in csv.DictReader(manifest)]
+        else:
+            jobs = [json.loads(line) for line in manifest if line.strip()]
+
+    for number, job in enumerate(jobs, 1):
+        if not isinstance(job, dict):
+            raise ValueError(f"Job {number} of {path} is not a JSON object")
+        job.setdefault("id", number)
+        for field in INT_FIELDS:
+            if field in job:
+                job[field] = int(job[field])
+    return jobs
+
+
+def is_retryable(error: Exception) -> bool:
+    return isinstance(error, RETRYABLE_ERRORS) or isinstance(error, OSError) and error.errno in RETRYABLE_ERRNOS
+
+
+def job_format(job: Dict[str, Any]) -> str:
+    if "format" in job:
+        return job["format"]
+    extension = os.path.splitext(job["input"])[1].lower()
+    return {".wav": "wav", ".mp3": "mp3"}.get(extension, "image")
+
+
+def run_job(job: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Runs a single job, raising ValueError if it is invalid. Returns the verdict of detection jobs."""
+    op = job.get("op")
+    for field in {"hide": ("input", "output", "secret"), "detect": ("input",)}.get(op, ("input", "output")):
+        if field not in job:
+            raise ValueError(f"The job has no {field}")
+    file_format = job_format(job)
+    lsb = job.get("lsb", DEFAULT_LSB)
+
+    if (op, file_format) == ("hide", "image"):
+        LSBSteg.hide_data(job["input"], job["secret"], job["output"], lsb, job.get("compression", 1))
+    elif (op, file_format) == ("recover", "image"):
+        LSBSteg.recover_data(job["input"], job["output"], lsb)
+    elif (op, file_format) == ("hide", "wav"):
+        WavSteg.hide_data(job["input"], job["secret"], job["output"], lsb)
+    elif (op, file_format) == ("recover", "wav"):
+        WavSteg.recover_data(job["input"], job["output"], job.get("lsb"), job.get("bytes"))
+    elif (op, file_format) == ("hide", "mp3"):
+        MP3hide.hide(job["input"], job["secret"], job["output"])
+    elif (op, file_format) == ("recover", "mp3"):
+        MP3hide.extract(job["input"], job["output"])
+    elif (op, file_format) == ("detect", "image"):
+        block_size = job.get("block_size", 8)
+        return stegscan.analyse(job["input"], (block_size, block_size), job.get("lsb"))
+    else:
+        raise ValueError(f"Unknown operation {op} for format {file_format}")
+    return None
+
+
+def warm_up() -> None:
+    """Loads what the first job would otherwise pay for: PIL and the interleaving kernels."""
+    LSBSteg.Image.init()
+    for byte_depth in (1, 2):
+        carrier = lsb_interleave_bytes(bytes(64 * byte_depth), bytes(8), 1, byte_depth=byte_depth)
+        lsb_deinterleave_bytes(carrier, 64, 1, byte_depth=byte_depth)
+
+
+def _run_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Worker task, runs the job and returns its status, time taken and error if it failed."""
+    start = perf_counter()
+    try:
+        # keep the output of the codecs out of results written to stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            verdict = run_job(job)
+        return {"status": "ok", "seconds": perf_counter() - start, **(verdict or {})}
+    except Exception as e:
+        return {"status": "failed", "seconds": perf_counter() - start, "error": f"{type(e).__name__}: {e}",
+                "retryable": is_retryable(e)}
+
+
+def run_batch(jobs: Iterable[Dict[str, Any]], workers: int = 1, retries: int = 1) -> Iterator[Dict[str, Any]]:
+    """Runs the jobs on a pool of processes, yielding each job updated with its result as it finishes.
+
+    Jobs failing with a transient I/O error (see RETRYABLE_ERRNOS) are run again once the others are done,
+    up to retries more times."""
+    with ProcessPoolExecutor(max(workers, 1), initializer=warm_up) as pool:
+        pending = list(jobs)
+        attempt = 1
+        while pending:
+            futures = {pool.submit(_run_job, job): job for job in pending}
+            pending = []
+            for future in as_completed(futures):
+                job = futures[future]
+                result = future.result()
+                if result.pop("retryable", False) and attempt <= retries:
+                    log.debug(f"Job {job.get('id')} failed, retrying: {result['error']}")
+                    pending.append(job)
+                    continue
+                yield {**job, **result, "attempts": attempt}
+            attempt += 1
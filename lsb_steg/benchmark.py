@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+    hide_stream.benchmark
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    End to end benchmarks of every codec on synthetic carriers, of the
+    time taken to import the CLI and the codecs, and of the latency of CLI
+    calls on tiny carriers, which is dominated by start up costs.
+
+    Each case runs in a fresh process so its peak resident memory can be
+    measured on its own, where it is first run once untimed so that lazy
+    imports and kernel loading aren't counted in its throughput. Results can be saved as JSON and compared against
+    a saved baseline to catch throughput or memory regressions.
+
+    :copyright: (c) 2015 by R433.
+    :license: MIT License, see LICENSE.md for more details.
+"""
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import wave
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+import LSBSteg
+import MP3hide
+import StegDetect
+import WavSteg
+import reverse_entropy
+from bit_manipulation import get_backend
+from lazy import lazy_import
+
+log = logging.getLogger(__name__)
+
+Image = lazy_import("PIL.Image")
+
+# Approximate carrier sizes in bytes
+SIZES = {"small": 1 << 20, "medium": 8 << 20, "large": 32 << 20}
+
+# LSBs used by the image and sound cases
+BENCH_LSB = 2
+
+# Allowed relative drop in throughput, or growth in peak memory, before a result counts as a regression
+DEFAULT_TOLERANCE = 0.1
+
+
+class Carriers(NamedTuple):
+    """Paths of the synthetic files a benchmark case works on."""
+    image: str
+    image_steg: str
+    sound: str
+    sound_steg: str
+    mp3: str
+    mp3_steg: str
+    secret: str
+    output: str
+
+
+class Result(NamedTuple):
+    case: str
+    size: str
+    carrier_bytes: int
+    seconds: float
+    throughput: float  # carrier MB processed per second
+    peak_rss: Optional[float]  # MB
+
+
+def _lsb_hide(c: Carriers) -> None:
+    LSBSteg.hide_data(c.image, c.secret, c.output + ".png", BENCH_LSB, 1)
+
+
+def _lsb_recover(c: Carriers) -> None:
+    LSBSteg.recover_data(c.image_steg, c.output, BENCH_LSB)
+
+
+def _wav_hide(c: Carriers) -> None:
+    WavSteg.hide_data(c.sound, c.secret, c.output + ".wav", BENCH_LSB)
+
+
+def _wav_recover(c: Carriers) -> None:
+    WavSteg.recover_data(c.sound_steg, c.output)
+
+
+def _mp3_hide(c: Carriers) -> None:
+    MP3hide.hide(c.mp3, c.secret, c.output + ".mp3")
+
+
+def _mp3_extract(c: Carriers) -> None:
+    MP3hide.extract(c.mp3_steg, c.output)
+
+
+def _show_lsb(c: Carriers) -> None:
+    StegDetect.show_lsb(c.image_steg, BENCH_LSB)
+
+
+def _entropy(c: Carriers) -> None:
+    reverse_entropy.scan(c.image_steg)
+
+
+# Benchmark cases, by name
+CASES: Dict[str, Callable[[Carriers], None]] = {
+    "lsb-hide": _lsb_hide,
+    "lsb-recover": _lsb_recover,
+    "wav-hide": _wav_hide,
+    "wav-recover": _wav_recover,
+    "mp3-hide": _mp3_hide,
+    "mp3-extract": _mp3_extract,
+    "show-lsb": _show_lsb,
+    "entropy": _entropy,
+}
+
+
+# Modules whose import time is benchmarked, by case name
+IMPORT_CASES = {f"import-{module}": module for module in
+                ("cli", "LSBSteg", "WavSteg", "MP3hide", "StegDetect", "reverse_entropy")}
+
+# Run in a fresh interpreter to time the import of the module named by its argument
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+__import__(sys.argv[1])
+seconds = time.perf_counter() - start
+# ru_maxrss carries over the peak of the parent across exec, the high water mark in /proc doesn't
+try:
+    with open("/proc/self/status") as status:
+        max_rss = next(int(line.split()[1]) for line in status if line.startswith("VmHWM:"))
+except OSError:
+    max_rss = None
+print(json.dumps({"seconds": seconds, "max_rss": max_rss}))
+"""
+
+# CLI calls on carriers of LATENCY_CARRIER_BYTES timed in a fresh interpreter, by case name, as arguments
+# taking the carriers and returning those of cli.py
+LATENCY_CASES: Dict[str, Callable[[Carriers], List[str]]] = {
+    "latency-lsb-recover": lambda c: ["steglsb", "-r", "-i", c.image_steg, "-o", c.output, "-n", str(BENCH_LSB)],
+    "latency-wav-recover": lambda c: ["wavsteg", "-r", "-i", c.sound_steg, "-o", c.output],
+}
+LATENCY_CARRIER_BYTES = 64 << 10
+
+
+def make_carriers(directory: str, carrier_bytes: int) -> Carriers:
+    """Writes a random image, sound file, MP3 and secret of about carrier_bytes each to directory,
+    along with copies of the carriers with the secret hidden in them."""
+    rng = np.random.default_rng(0)
+    side = int((carrier_bytes / 3) ** 0.5)
+    paths = Carriers(*(os.path.join(directory, name) for name in (
+        "image.png", "image-steg.png", "sound.wav", "sound-steg.wav", "sound.mp3", "sound-steg.mp3",
+        "secret.bin", "output")))
+
+    Image.fromarray(rng.integers(0, 256, (side, side, 3), dtype=np.uint8)).save(paths.image, compress_level=1)
+    with wave.open(paths.sound, "wb") as sound:
+        sound.setnchannels(2)
+        sound.setsampwidth(2)
+        sound.setframerate(44100)
+        sound.writeframes(rng.integers(0, 256, carrier_bytes // 4 * 4, dtype=np.uint8).tobytes())
+    with open(paths.mp3, "wb") as mp3:
+        mp3.write(rng.integers(0, 256, carrier_bytes, dtype=np.uint8).tobytes())
+    # A secret filling about half of the capacity of the 16-bit sound file, and a quarter of the image's
+    with open(paths.secret, "wb") as secret:
+        secret.write(rng.integers(0, 256, carrier_bytes * BENCH_LSB // 32, dtype=np.uint8).tobytes())
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        LSBSteg.hide_data(paths.image, paths.secret, paths.image_steg, BENCH_LSB, 1)
+        WavSteg.hide_data(paths.sound, paths.secret, paths.sound_steg, BENCH_LSB)
+        MP3hide.hide(paths.mp3, paths.secret, paths.mp3_steg)
+    return paths
+
+
+def peak_rss() -> Optional[float]:
+    """Returns the peak resident memory of this process in MB, or None where it can't be measured.
+
+    The high water mark in /proc is used as IMPORT_SCRIPT does, since ru_maxrss carries over
+    the peak of the parent across exec, which would hide that of the case."""
+    try:
+        with open("/proc/self/status") as status:
+            return next(int(line.split()[1]) for line in status if line.startswith("VmHWM:")) / (1 << 10)
+    except (OSError, StopIteration):
+        return None
+
+
+def _run_case(case: str, carriers: Carriers, repeat: int) -> Dict[str, Any]:
+    """Runs one case once untimed, then repeat times, in a process of its own, returning the best time."""
+    logging.disable(logging.CRITICAL)
+    times = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        CASES[case](carriers)
+        for _ in range(repeat):
+            start = perf_counter()
+            CASES[case](carriers)
+            times.append(perf_counter() - start)
+    return {"seconds": min(times), "peak_rss": peak_rss()}
+
+
+def _time_import(module: str) -> Dict[str, Any]:
+    """Times the import of module in a fresh interpreter."""
+    completed = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT, module], capture_output=True, check=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    measured = json.loads(completed.stdout.splitlines()[-1])
+    peak = measured["max_rss"] / (1 << 10) if measured["max_rss"] is not None else None
+    return {"seconds": measured["seconds"], "peak_rss": peak}
+
+
+def _time_cli_call(args: List[str]) -> Dict[str, Any]:
+    """Times a call of the CLI with args in a fresh interpreter, start up included."""
+    start = perf_counter()
+    subprocess.run([sys.executable, "cli.py", *args], capture_output=True, check=True,
+                   cwd=os.path.dirname(os.path.abspath(__file__)))
+    return {"seconds": perf_counter() - start, "peak_rss": None}
+
+
+def run(cases: Optional[Iterable[str]] = None, sizes: Optional[Iterable[str]] = None,
+        repeat: int = 3) -> List[Result]:
+    """Runs the benchmark cases on carriers of each size, keeping the best time out of repeat runs of each
+    and their peak memory. Import and latency cases don't depend on the carrier size and run once."""
+    cases = list(cases or [*IMPORT_CASES, *LATENCY_CASES, *CASES])
+    sizes = list(sizes or SIZES)
+    results = []
+    context = multiprocessing.get_context("spawn")
+
+    for case in cases:
+        if case in IMPORT_CASES:
+            runs = [_time_import(IMPORT_CASES[case]) for _ in range(repeat)]
+            seconds = min(r["seconds"] for r in runs)
+            rss = [r["peak_rss"] for r in runs if r["peak_rss"] is not None]
+            log.debug(f"{case:<30} in {seconds:.2f}s")
+            results.append(Result(case, "-", 0, seconds, 0.0, max(rss) if rss else None))
+
+    latency_cases = [case for case in cases if case in LATENCY_CASES]
+    if latency_cases:
+        with tempfile.TemporaryDirectory() as directory:
+            carriers = make_carriers(directory, LATENCY_CARRIER_BYTES)
+            for case in latency_cases:
+                seconds = min(_time_cli_call(LATENCY_CASES[case](carriers))["seconds"] for _ in range(repeat))
+                log.debug(f"{case:<30} in {seconds:.2f}s")
+                results.append(Result(case, "-", 0, seconds, 0.0, None))
+    cases = [case for case in cases if case in CASES]
+
+    for size in sizes if cases else ():
+        with tempfile.TemporaryDirectory() as directory:
+            carriers = make_carriers(directory, SIZES[size])
+            for case in cases:
+                # One process per case so its peak memory isn't hidden by an earlier case or the carriers
+                with context.Pool(1) as pool:
+                    measured = pool.apply(_run_case, (case, carriers, repeat))
+                seconds = measured["seconds"]
+                result = Result(case, size, SIZES[size], seconds, SIZES[size] / 1e6 / seconds, measured["peak_rss"])
+                log.debug(f"{f'{case} ({size})':<30} in {seconds:.2f}s")
+                results.append(result)
+    return results
+
+
+def print_results(results: Sequence[Result]) -> None:
+    print("\n" + "-" * 77)
+    print(f"| {'Case':<24}| {'Size':<8}| {'Time':<10}| {'Throughput':<13}| {'Peak memory':<12}|")
+    for r in results:
+        throughput = f"{r.throughput:.1f} MB/s" if r.carrier_bytes else "-"
+        rss = f"{r.peak_rss:.1f} MB" if r.peak_rss is not None else "n/a"
+        print(f"| {r.case:<24}| {r.size:<8}| {f'{r.seconds:.3f}s':<10}| {throughput:<13}| {rss:<12}|")
+    print("-" * 77)
+
+
+def to_json(results: Sequence[Result]) -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "backend": get_backend(),
+        "results": [r._asdict() for r in results],
+    }
+
+
+def compare(results: Sequence[Result], baseline: Dict[str, Any],
+            tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """Returns a description of every result whose time or peak memory is more than tolerance above
+    the matching result of a baseline saved with to_json. For a given case and size, a longer time is
+    the same as a lower throughput."""
+    previous = {(b["case"], b["size"]): b for b in baseline["results"]}
+    regressions = []
+    for r in results:
+        b = previous.get((r.case, r.size))
+        if b is None:
+            continue
+        if r.seconds > b["seconds"] * (1 + tolerance):
+            regressions.append(f"{r.case} ({r.size}): {r.seconds:.3f}s, baseline {b['seconds']:.3f}s")
+        if r.peak_rss is not None and b["peak_rss"] is not None and r.peak_rss > b["peak_rss"] * (1 + tolerance):
+            regressions.append(f"{r.case} ({r.size}): peak memory {r.peak_rss:.1f} MB, "
+                               f"baseline {b['peak_rss']:.1f} MB")
+    return regressions
+
+
+def benchmark(cases: Optional[Iterable[str]] = None, sizes: Optional[Iterable[str]] = None, repeat: int = 3,
+              output_path: Optional[str] = None, baseline_path: Optional[str] = None,
+              tolerance: float = DEFAULT_TOLERANCE) -> bool:
+    """Runs and prints the benchmarks, saving them as JSON to output_path if given.
+    Returns False if any result regressed against the baseline at baseline_path."""
+    results = run(cases, sizes, repeat)
+    print_results(results)
+
+    if output_path:
+        with open(output_path, "w") as output:
+            json.dump(to_json(results), output, indent=2)
+
+    if baseline_path:
+        with open(baseline_path) as baseline:
+            regressions = compare(results, json.load(baseline), tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        return not regressions
+    return True
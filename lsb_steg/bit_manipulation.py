@@ -1,30 +1,42 @@
 
 
+import importlib.util
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from math import ceil
 from time import time
-from typing import List
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 import numpy as np
 
+__all__ = [
+    "Buffer", "roundup", "SHIFT_KERNEL_LSBS", "interleave_unpackbits", "deinterleave_unpackbits", "interleave_shift",
+    "deinterleave_shift", "interleave_numpy", "deinterleave_numpy", "interleave_numba", "deinterleave_numba",
+    "BACKENDS", "PARALLEL_BACKENDS", "register_backend", "set_backend", "get_backend", "resolve_workers",
+    "payload_chunks", "interleave", "deinterleave", "as_array", "lsb_interleave_bytes", "lsb_deinterleave_bytes",
+    "lsb_interleave_array", "lsb_deinterleave_array", "lsb_interleave_list", "lsb_deinterleave_list", "test",
+]
+
+
+log = logging.getLogger(__name__)
+
+# Objects supporting the buffer protocol which the interleaving functions accept
+Buffer = Union[bytes, bytearray, memoryview, np.ndarray]
+
 
 def roundup(x: float, base: int = 1) -> int:
     return int(ceil(x / base)) * base
 
 
-def lsb_interleave_bytes(carrier: bytes, payload: bytes, num_lsb: int, truncate: bool = False,
-                         byte_depth: int = 1) -> bytes:
-    """
-    Interleave the bytes of payload into the num_lsb LSBs of carrier.
+# Numbers of LSBs which divide a byte evenly, for which the shift kernels are used
+SHIFT_KERNEL_LSBS = (1, 2, 4, 8)
 
-    :param carrier: carrier bytes
-    :param payload: payload bytes
-    :param num_lsb: number of least significant bits to use
-    :param truncate: if True, will only return the interleaved part
-    :param byte_depth: byte depth of carrier values
-    :return: The interleaved bytes
-    """
 
+def interleave_unpackbits(carrier: bytes, payload: bytes, num_lsb: int, byte_depth: int = 1) -> np.ndarray:
+    """Interleaving kernel for any num_lsb, which expands carrier and payload to one byte per bit.
+
+    Returns only the interleaved part of the carrier."""
     plen = len(payload)
     payload_bits = np.zeros(shape=(plen, 8), dtype=np.uint8)
     payload_bits[:plen, :] = np.unpackbits(np.frombuffer(payload, dtype=np.uint8, count=plen)).reshape(plen, 8)
@@ -36,77 +48,349 @@ def lsb_interleave_bytes(carrier: bytes, payload: bytes, num_lsb: int, truncate:
                                  ).reshape(bit_height, 8 * byte_depth)
     carrier_bits[:, 8 * byte_depth - num_lsb: 8 * byte_depth] = payload_bits.reshape(bit_height, num_lsb)
 
-    ret = np.packbits(carrier_bits).tobytes()
-    return ret if truncate else ret + carrier[byte_depth * bit_height:]
+    return np.packbits(carrier_bits)
+
+
+def deinterleave_unpackbits(carrier: bytes, num_bits: int, num_lsb: int, byte_depth: int = 1) -> np.ndarray:
+    """Deinterleaving kernel for any num_lsb, which expands the carrier to one byte per bit."""
+    plen = roundup(num_bits / num_lsb)
+    payload_bits = np.unpackbits(np.frombuffer(carrier, dtype=np.uint8, count=byte_depth * plen)
+                                 ).reshape(plen, 8 * byte_depth)[:, 8 * byte_depth - num_lsb: 8 * byte_depth]
+    return np.packbits(payload_bits)[: num_bits // 8]
+
+
+def interleave_shift(carrier: bytes, payload: bytes, num_lsb: int, byte_depth: int = 1) -> np.ndarray:
+    """Interleaving kernel for num_lsb in SHIFT_KERNEL_LSBS, which works with shifts and masks on whole bytes.
+
+    Each payload byte is spread over 8 // num_lsb carrier values, so the i-th group
+    of num_lsb bits of every payload byte can be written with one strided operation.
+    Returns only the interleaved part of the carrier."""
+    groups = 8 // num_lsb
+    plen = len(payload)
+    mask = (1 << num_lsb) - 1
+
+    payload_bytes = np.frombuffer(payload, dtype=np.uint8, count=plen)
+    ret = np.frombuffer(carrier, dtype=np.uint8, count=byte_depth * groups * plen).copy()
+    # the LSBs are in the last byte of each carrier value
+    lsb_bytes = ret.reshape(plen, groups, byte_depth)[:, :, byte_depth - 1]
+    for group in range(groups):
+        shift = 8 - num_lsb * (group + 1)
+        lsb_bytes[:, group] &= 0xFF ^ mask
+        lsb_bytes[:, group] |= (payload_bytes >> shift) & mask
+    return ret
+
+
+def deinterleave_shift(carrier: bytes, num_bits: int, num_lsb: int, byte_depth: int = 1) -> np.ndarray:
+    """Deinterleaving kernel for num_lsb in SHIFT_KERNEL_LSBS, which works with shifts and masks on whole bytes."""
+    groups = 8 // num_lsb
+    plen = num_bits // 8
+    mask = (1 << num_lsb) - 1
+
+    lsb_bytes = np.frombuffer(carrier, dtype=np.uint8, count=byte_depth * groups * plen
+                              ).reshape(plen, groups, byte_depth)[:, :, byte_depth - 1]
+    ret = np.zeros(plen, dtype=np.uint8)
+    for group in range(groups):
+        shift = 8 - num_lsb * (group + 1)
+        ret |= (lsb_bytes[:, group] & mask) << shift
+    return ret
+
+
+def interleave_numpy(carrier: bytes, payload: bytes, num_lsb: int, byte_depth: int = 1) -> np.ndarray:
+    """Interleaving kernel which uses the shift kernel where possible and unpackbits otherwise."""
+    kernel = interleave_shift if num_lsb in SHIFT_KERNEL_LSBS else interleave_unpackbits
+    return kernel(carrier, payload, num_lsb, byte_depth)
+
+
+def deinterleave_numpy(carrier: bytes, num_bits: int, num_lsb: int, byte_depth: int = 1) -> np.ndarray:
+    """Deinterleaving kernel which uses the shift kernel where possible and unpackbits otherwise."""
+    kernel = deinterleave_shift if num_lsb in SHIFT_KERNEL_LSBS else deinterleave_unpackbits
+    return kernel(carrier, num_bits, num_lsb, byte_depth)
+
+
+def interleave_numba(carrier: bytes, payload: bytes, num_lsb: int, byte_depth: int = 1) -> np.ndarray:
+    """Interleaving kernel compiled with Numba, which handles one carrier value per iteration in parallel.
+
+    The kernel only writes the last byte of each value, so more than 8 LSBs are left to interleave_numpy."""
+    if num_lsb > 8:
+        return interleave_numpy(carrier, payload, num_lsb, byte_depth)
+    bit_height = roundup(len(payload) * 8 / num_lsb)
+    carrier_bytes = np.frombuffer(carrier, dtype=np.uint8, count=byte_depth * bit_height)
+    ret = np.empty_like(carrier_bytes)
+    from numba_kernels import interleave_kernel
+    interleave_kernel(carrier_bytes, np.frombuffer(payload, dtype=np.uint8), num_lsb, byte_depth, ret)
+    return ret
+
+
+def deinterleave_numba(carrier: bytes, num_bits: int, num_lsb: int, byte_depth: int = 1) -> np.ndarray:
+    """Deinterleaving kernel compiled with Numba, which assembles one payload byte per iteration in parallel.
+
+    The kernel only reads the last byte of each value, so more than 8 LSBs are left to deinterleave_numpy."""
+    if num_lsb > 8:
+        return deinterleave_numpy(carrier, num_bits, num_lsb, byte_depth)
+    carrier_bytes = np.frombuffer(carrier, dtype=np.uint8, count=byte_depth * roundup(num_bits / num_lsb))
+    ret = np.empty(num_bits // 8, dtype=np.uint8)
+    from numba_kernels import deinterleave_kernel
+    deinterleave_kernel(carrier_bytes, num_lsb, byte_depth, ret)
+    return ret
+
+
+# Interleaving and deinterleaving kernels by backend name
+BACKENDS: Dict[str, Tuple[Callable[..., np.ndarray], Callable[..., np.ndarray]]] = {
+    "numpy": (interleave_numpy, deinterleave_numpy),
+}
+# numba is only imported, and the kernels loaded, on their first call
+if importlib.util.find_spec("numba") is not None:
+    BACKENDS["numba"] = (interleave_numba, deinterleave_numba)
+
+# Backends whose kernels already use every core, which aren't split across threads
+PARALLEL_BACKENDS = {"numba"}
+
+# numba is only used once selected, as loading it and its cached kernels takes longer than
+# the numpy kernels take on the small payloads most calls hide or recover
+_backend = "numpy"
+
+
+def register_backend(name: str, interleave: Callable[..., np.ndarray], deinterleave: Callable[..., np.ndarray]) -> None:
+    """Registers a pair of kernels with the signatures of interleave_numpy and deinterleave_numpy."""
+    BACKENDS[name] = (interleave, deinterleave)
+
+
+def set_backend(name: str) -> None:
+    """Selects the kernels used by lsb_interleave_bytes and lsb_deinterleave_bytes."""
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name}, available backends are {', '.join(BACKENDS)}")
+    _backend = name
+    log.debug(f"Using the {name} backend")
+
+
+def get_backend() -> str:
+    """Returns the name of the backend used by lsb_interleave_bytes and lsb_deinterleave_bytes."""
+    return _backend
+
+
+if os.environ.get("HIDESTREAM_BACKEND"):
+    set_backend(os.environ["HIDESTREAM_BACKEND"])
+
+
+def resolve_workers(workers: int) -> int:
+    """Returns the number of threads to use, where workers < 1 means one per core."""
+    return workers if workers >= 1 else os.cpu_count() or 1
+
+
+def payload_chunks(num_bytes: int, num_lsb: int, workers: int) -> List[Tuple[int, int]]:
+    """Splits num_bytes payload bytes into up to workers (start, end) ranges.
+
+    Every range starts at a multiple of num_lsb bytes, which fill exactly 8
+    carrier values, so each chunk can be interleaved independently."""
+    chunk_size = roundup(num_bytes / max(workers, 1), num_lsb)
+    if workers <= 1 or chunk_size == 0:
+        return [(0, num_bytes)]
+    return [(start, min(start + chunk_size, num_bytes)) for start in range(0, num_bytes, chunk_size)]
+
+
+def interleave(carrier: bytes, payload: bytes, num_lsb: int, byte_depth: int = 1, workers: int = 1,
+               out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Runs the selected backend's interleaving kernel, on chunks in a thread pool if workers > 1.
 
+    Returns only the interleaved part of the carrier, written into the start of
+    the uint8 array out if given (which may share memory with the carrier)."""
+    kernel = BACKENDS[_backend][0]
+    chunks = payload_chunks(len(payload), num_lsb, resolve_workers(workers))
+    if len(chunks) == 1 or _backend in PARALLEL_BACKENDS:
+        ret = kernel(carrier, payload, num_lsb, byte_depth)
+        if out is None:
+            return ret
+        out[:len(ret)] = ret
+        return out[:len(ret)]
 
-def lsb_deinterleave_bytes(carrier: bytes, num_bits: int, num_lsb: int, byte_depth: int = 1) -> bytes:
+    bit_height = roundup(len(payload) * 8 / num_lsb)
+    carrier_bytes = np.frombuffer(carrier, dtype=np.uint8, count=byte_depth * bit_height)
+    payload_view = memoryview(payload).cast("B")
+    ret = np.empty_like(carrier_bytes) if out is None else out[:len(carrier_bytes)]
+
+    def interleave_chunk(chunk: Tuple[int, int]) -> None:
+        start, end = chunk
+        offset = byte_depth * 8 * start // num_lsb
+        # each kernel reads its part of the carrier before it is overwritten, so out may be the carrier
+        part = kernel(carrier_bytes[offset:], payload_view[start:end], num_lsb, byte_depth)
+        ret[offset:offset + len(part)] = part
+
+    # NumPy releases the GIL in the kernels' array operations
+    with ThreadPoolExecutor(len(chunks)) as pool:
+        list(pool.map(interleave_chunk, chunks))
+    return ret
+
+
+def deinterleave(carrier: bytes, num_bits: int, num_lsb: int, byte_depth: int = 1, workers: int = 1,
+                 out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Runs the selected backend's deinterleaving kernel, on chunks in a thread pool if workers > 1.
+
+    The result is written into the start of the uint8 array out if given."""
+    kernel = BACKENDS[_backend][1]
+    chunks = payload_chunks(num_bits // 8, num_lsb, resolve_workers(workers))
+    if len(chunks) == 1 or _backend in PARALLEL_BACKENDS:
+        ret = kernel(carrier, num_bits, num_lsb, byte_depth)
+        if out is None:
+            return ret
+        out[:len(ret)] = ret
+        return out[:len(ret)]
+
+    carrier_bytes = np.frombuffer(carrier, dtype=np.uint8, count=byte_depth * roundup(num_bits / num_lsb))
+    ret = np.empty(num_bits // 8, dtype=np.uint8) if out is None else out[:num_bits // 8]
+
+    def deinterleave_chunk(chunk: Tuple[int, int]) -> None:
+        start, end = chunk
+        offset = byte_depth * 8 * start // num_lsb
+        ret[start:end] = kernel(carrier_bytes[offset:], 8 * (end - start), num_lsb, byte_depth)
+
+    with ThreadPoolExecutor(len(chunks)) as pool:
+        list(pool.map(deinterleave_chunk, chunks))
+    return ret
+
+
+def as_array(buffer: Union[bytes, bytearray, memoryview, np.ndarray]) -> np.ndarray:
+    """Returns a flat uint8 array sharing memory with buffer."""
+    if isinstance(buffer, np.ndarray):
+        return buffer.reshape(-1).view(np.uint8)
+    return np.frombuffer(buffer, dtype=np.uint8)
+
+
+def lsb_interleave_bytes(carrier: Buffer, payload: Buffer, num_lsb: int, truncate: bool = False,
+                         byte_depth: int = 1, workers: int = 1, out: Optional[Buffer] = None) -> Buffer:
+    """
+    Interleave the bytes of payload into the num_lsb LSBs of carrier.
+
+    carrier and payload may be any object supporting the buffer protocol
+    (bytes, bytearray, memoryview, NumPy arrays...). If out is given, the
+    result is written into it instead of a new bytes object. out may be the
+    carrier itself, in which case only the interleaved part is rewritten and
+    the rest of the carrier is never copied.
+
+    :param carrier: carrier bytes
+    :param payload: payload bytes
+    :param num_lsb: number of least significant bits to use
+    :param truncate: if True, will only return the interleaved part
+    :param byte_depth: byte depth of carrier values
+    :param workers: number of threads to split the work across, < 1 for one per core
+    :param out: writable buffer at least as long as the result
+    :return: The interleaved bytes, or out if given
+    """
+    if out is None:
+        ret = interleave(carrier, payload, num_lsb, byte_depth, workers).tobytes()
+        return ret if truncate else ret + memoryview(carrier).cast("B")[len(ret):]
+
+    carrier_bytes = as_array(carrier)
+    out_bytes = as_array(out)
+    interleaved = len(interleave(carrier_bytes, payload, num_lsb, byte_depth, workers, out=out_bytes))
+    if not truncate and not np.shares_memory(carrier_bytes, out_bytes):
+        out_bytes[interleaved:len(carrier_bytes)] = carrier_bytes[interleaved:]
+    return out
+
+
+def lsb_deinterleave_bytes(carrier: Buffer, num_bits: int, num_lsb: int, byte_depth: int = 1,
+                           workers: int = 1, out: Optional[Buffer] = None) -> Buffer:
     """
     Deinterleave num_bits bits from the num_lsb LSBs of carrier.
 
+    carrier may be any object supporting the buffer protocol. If out is
+    given, the result is written into it instead of a new bytes object.
+
     :param carrier: carrier bytes
     :param num_bits: number of num_bits to retrieve
     :param num_lsb: number of least significant bits to use
     :param byte_depth: byte depth of carrier values
-    :return: The deinterleaved bytes
+    :param workers: number of threads to split the work across, < 1 for one per core
+    :param out: writable buffer of at least num_bits // 8 bytes
+    :return: The deinterleaved bytes, or out if given
     """
+    if out is None:
+        return deinterleave(carrier, num_bits, num_lsb, byte_depth, workers).tobytes()
+    deinterleave(carrier, num_bits, num_lsb, byte_depth, workers, out=as_array(out))
+    return out
 
-    plen = roundup(num_bits / num_lsb)
-    payload_bits = np.unpackbits(np.frombuffer(carrier, dtype=np.uint8, count=byte_depth * plen)
-                                 ).reshape(plen, 8 * byte_depth)[:, 8 * byte_depth - num_lsb: 8 * byte_depth]
-    return np.packbits(payload_bits).tobytes()[: num_bits // 8]
+
+def lsb_interleave_array(carrier: np.ndarray, payload: bytes, num_lsb: int, workers: int = 1) -> np.ndarray:
+    """Interleave the bytes of payload into the num_lsb LSBs of a uint8 array, in place.
+
+    The array is treated as a flat sequence of values, so any C-contiguous
+    shape (e.g. the (height, width, channels) array of an image) can be used
+    without copying. Only the prefix which holds the payload is rewritten.
+
+    :param carrier: writable, C-contiguous uint8 array
+    :param payload: payload bytes
+    :param num_lsb: number of least significant bits to use
+    :param workers: number of threads to split the work across, < 1 for one per core
+    :return: The carrier array
+    """
+    lsb_interleave_bytes(carrier, payload, num_lsb, truncate=True, workers=workers, out=carrier)
+    return carrier
+
+
+def lsb_deinterleave_array(carrier: np.ndarray, num_bits: int, num_lsb: int, workers: int = 1) -> bytes:
+    """Deinterleave num_bits bits from the num_lsb LSBs of a uint8 array.
+
+    :param carrier: C-contiguous uint8 array
+    :param num_bits: number of num_bits to retrieve
+    :param num_lsb: number of least significant bits to use
+    :param workers: number of threads to split the work across, < 1 for one per core
+    :return: The deinterleaved bytes
+    """
+    return lsb_deinterleave_bytes(carrier.reshape(-1), num_bits, num_lsb, workers=workers)
 
 
 def lsb_interleave_list(carrier: List[np.uint8], payload: bytes, num_lsb: int) -> List[np.uint8]:
-    """Runs lsb_interleave_bytes with a List[uint8] carrier.
+    """Runs lsb_interleave_array with a List[uint8] carrier.
 
-    This is slower than working with bytes directly, but is often
-    unavoidable if working with libraries that require using lists."""
+    Kept for compatibility only; prefer lsb_interleave_array, which avoids
+    creating a Python object per carrier value."""
     bit_height = roundup(8 * len(payload) / num_lsb)
-    carrier_bytes = np.array(carrier[:bit_height], dtype=np.uint8).tobytes()
-    interleaved = lsb_interleave_bytes(carrier_bytes, payload, num_lsb, truncate=True)
-    carrier[:bit_height] = np.frombuffer(interleaved, dtype=np.uint8).tolist()
+    carrier_array = np.array(carrier[:bit_height], dtype=np.uint8)
+    carrier[:bit_height] = lsb_interleave_array(carrier_array, payload, num_lsb).tolist()
     return carrier
 
 
 def lsb_deinterleave_list(carrier: List[np.uint8], num_bits: int, num_lsb: int) -> bytes:
-    """Runs lsb_deinterleave_bytes with a List[uint8] carrier.
+    """Runs lsb_deinterleave_array with a List[uint8] carrier.
 
-    This is slower than working with bytes directly, but is often
-    unavoidable if working with libraries that require using lists."""
+    Kept for compatibility only; prefer lsb_deinterleave_array, which avoids
+    creating a Python object per carrier value."""
     plen = roundup(num_bits / num_lsb)
-    carrier_bytes = np.array(carrier[:plen], dtype=np.uint8).tobytes()
-    deinterleaved = lsb_deinterleave_bytes(carrier_bytes, num_bits, num_lsb)
-    return deinterleaved
+    return lsb_deinterleave_array(np.array(carrier[:plen], dtype=np.uint8), num_bits, num_lsb)
 
 
 def test(carrier_len: int = 10 ** 7, payload_len: int = 10 ** 6) -> bool:
     """Runs consistency tests with a random carrier and payload of byte
     lengths carrier_len and payload_len, respectively."""
 
-    def print_results(e_rates: List[str], d_rates: List[str]) -> None:
-        print("\n" + "-" * 40)
-        print(f"| {'# LSBs':<7}| {'Encode Rate':<13}| {'Decode rate':<13}|")
-        for n, e, d in zip(range(1, 9), e_rates[1:], d_rates[1:]):
-            print(f"| {n:<7}| {e:<13}| {d:<13}|")
-        print("-" * 40)
+    def print_results(e_rates: List[str], d_rates: List[str], speedups: List[str]) -> None:
+        print("\n" + "-" * 57)
+        print(f"| {'# LSBs':<7}| {'Encode Rate':<13}| {'Decode rate':<13}| {'vs unpackbits':<14}|")
+        for n, e, d, x in zip(range(1, 9), e_rates[1:], d_rates[1:], speedups[1:]):
+            print(f"| {n:<7}| {e:<13}| {d:<13}| {x:<14}|")
+        print("-" * 57)
 
     current_progress = 0
 
     def progress() -> None:
         nonlocal current_progress
-        print(f"\rProgress: [{'#' * current_progress}{'-' * (32 - current_progress)}]", end="", flush=True)
+        print(f"\rProgress: [{'#' * current_progress}{'-' * (40 - current_progress)}]", end="", flush=True)
         current_progress += 1
 
-    print(f"Testing {payload_len / 1e6:.1f} MB payload -> {carrier_len / 1e6:.1f} MB carrier...")
+    print(f"Testing {payload_len / 1e6:.1f} MB payload -> {carrier_len / 1e6:.1f} MB carrier "
+          f"with the {get_backend()} backend...")
     progress()
 
     carrier = os.urandom(carrier_len)
     payload = os.urandom(payload_len)
     encode_rates = [""] * 9
     decode_rates = [""] * 9
+    speedups = [""] * 9
 
     for num_lsb in range(1, 9):
+        # compile or load the kernels for this carrier type before timing them
+        lsb_deinterleave_bytes(lsb_interleave_bytes(carrier[:64], payload[:8], num_lsb), 64, num_lsb)
+
         # LSB interleavings that match carrier length
         encoded = lsb_interleave_bytes(carrier, payload, num_lsb)
         progress()
@@ -127,11 +411,36 @@ def test(carrier_len: int = 10 ** 7, payload_len: int = 10 ** 6) -> bool:
         encode_rates[num_lsb] = f"{(payload_len / 1e6) / encode_time:<6.1f} MB/s"
         decode_rates[num_lsb] = f"{(payload_len / 1e6) / decode_time:<6.1f} MB/s"
 
+        # compare against the generic kernels, which must give identical results
+        reference_time = time()
+        reference_encode = interleave_unpackbits(carrier, payload, num_lsb).tobytes()
+        reference_encode_time = time() - reference_time
+        reference_time = time()
+        reference_decode = deinterleave_unpackbits(reference_encode, 8 * payload_len, num_lsb).tobytes()
+        reference_decode_time = time() - reference_time
+        speedups[num_lsb] = f"{reference_encode_time / encode_time:.1f}x / {reference_decode_time / decode_time:.1f}x"
+
+        if reference_encode != truncated_encode or reference_decode != payload:
+            print(f"\nTest failed at {num_lsb} LSBs, kernels disagree!")
+            return False
+        progress()
+
         if decoded != payload or truncated_decode != payload:
             print(f"\nTest failed at {num_lsb} LSBs!")
             return False
 
-    print_results(encode_rates, decode_rates)
+    # multi-byte carrier values, as in 16 to 32 bit sound, up to every bit of the value
+    for byte_depth in range(2, 5):
+        for num_lsb in range(1, 8 * byte_depth + 1):
+            sample_payload = payload[:4096]
+            encoded = lsb_interleave_bytes(carrier, sample_payload, num_lsb, truncate=True, byte_depth=byte_depth)
+            reference_encode = interleave_unpackbits(carrier, sample_payload, num_lsb, byte_depth).tobytes()
+            decoded = lsb_deinterleave_bytes(encoded, 8 * len(sample_payload), num_lsb, byte_depth=byte_depth)
+            if encoded != reference_encode or decoded != sample_payload:
+                print(f"\nTest failed at {num_lsb} LSBs with {byte_depth} byte values!")
+                return False
+
+    print_results(encode_rates, decode_rates, speedups)
     return True
 
 
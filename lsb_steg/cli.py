@@ -16,7 +16,12 @@
 # Commands:
 #   mp3steg     Handles MP3 steganography operations using MP3hide.py
 #   stegdetect  Shows the n least significant bits of image
+#   stegscan    Runs the entropy analysis on every image in directories or globs
 #   steglsb     Hides or recovers data in and from an image
+#   batch       Runs the hide, recover and detect jobs of a CSV or JSON lines manifest
+#   serve       Runs batch jobs sent to a Unix socket on warm worker processes
+#   client      Sends the jobs of a manifest to a running serve command
+#   bench       Benchmarks every codec end to end on synthetic carriers
 #   test        Runs a performance test and verifies decoding consistency
 #   wavsteg     Hides or recovers data in and from a sound file
 
@@ -37,36 +42,87 @@
 #     Reveal:
 
 #             python3 cli.py steglsb -r -i test-steg.png -o msg.txt     
+
+#             add "--png-jobs 0" to the hide command to encode a large .png output on every core
+#             data is hidden across every frame of animated .png and multi-page .tif images, in order
     
 #     Wav:
 
 #     Hide: 
 #             python3 cli.py wavsteg -h -i ./test.wav -s ./msg.txt -o ./test-steg.wav
 #     Reveal:
-#             python3 cli.py wavsteg -r -i ./test-steg.wav -o ./msg-wav.txt -b 22
+#             python3 cli.py wavsteg -r -i ./test-steg.wav -o ./msg-wav.txt
+
+#             note: the size of the data and the LSB count are hidden in a header before it. files hidden with
+#             "--no-header" (or by older versions) need "-b", the number of bytes to recover, and "-n"
 
-#             note: "-b" here is the number of bytes to recover. wav steg needs that parameter
+#             add "--in-place" to the hide command to copy the wav and patch only the samples holding the data
+#             (also works for uncompressed .bmp files with steglsb)
+#             add "--stream" to either command to process large files in chunks of "--chunk-frames" frames
     
 #     StegDetect:
 
 #             python3 cli.py stegdetect -i ./test.png
 
+#             add "-e" to also run the reverse entropy analysis headlessly ("-j 4" to use 4 processes, "--plot" to plot)
+
+#     StegScan:
+
+#             python3 cli.py stegscan ./uploads "./incoming/**/*.png" -j 8 -o results.jsonl
+
+#             writes one JSON line per image. verdicts are cached by file content in "--cache", so unchanged files
+#             aren't analysed again
+
 #     note: only for images. i outputs an image which shows possible areas in the image that maybe hiding data in them. uses reverse entropy analysis and looks for areas where the entropy is high and randomness is lower than the average
 
 # We sum the least significant n bits of the RGB color channels for each pixel and normalize the result to the range 0-255. 
 # This value is then applied to each color channel for the pixel. 
 # Where n is the number of least significant bits to show, the following command will save the resulting image, appending "_nLSBs" to the file name.
+
+#     Batch:
+
+#             python3 cli.py batch jobs.csv -j 8 -o results.jsonl
+
+#             each row (or JSON line) is a job with "op" (hide, recover or detect), "input", "output", and "secret"
+#             when hiding, optionally "format" (image, wav or mp3, guessed from the input), "lsb", "compression",
+#             "bytes" and "id". see batch.py
+
+#     Serve:
+
+#             python3 cli.py serve -j 4 &
+#             python3 cli.py client jobs.jsonl -o results.jsonl
+
+#             the server keeps its workers, with numpy and PIL imported, between requests. clients send batch jobs
+#             (see batch.py) as JSON lines over "--socket" and get a JSON line back as each job finishes
+
+#     Timings:
+
+#             python3 cli.py --timings text steglsb -h -i test.png -s msg.txt -o test-steg.png
+
+#             prints the time taken by each phase to stderr, "--timings json" prints one JSON object per phase
+
+#     Profiling:
+
+#             python3 cli.py --profile steglsb -h -i test.png -s msg.txt -o test-steg.png
+
+#             writes test-steg.png.prof (open it with pstats or snakeviz) and test-steg.png.alloc.txt,
+#             the top "--profile-top" allocation sites. commands without an output use hidestream-<command>
             
 
 
 # :copyright: (c) 2015 by R433.
 # :license: MIT License, see LICENSE.md for more details.
 # """
+import json
 import logging
+import socket
+from types import ModuleType
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
 import click
 
 
-import LSBSteg, StegDetect, WavSteg, bit_manipulation
+import LSBSteg, StegDetect, WavSteg, batch, benchmark, bit_manipulation, profiling, reverse_entropy, stegscan, timing
 from MP3hide import hide_file_in_mp3, reveal_file_from_mp3
 
 # Enable logging output
@@ -75,10 +131,47 @@ log = logging.getLogger("lsb_stego")
 log.setLevel(logging.DEBUG)
 
 
+def echo_timings(spans: List[timing.Span], timings_format: str) -> None:
+    """Writes the spans to stderr, as JSON lines or as an indented table."""
+    for span in sorted(spans, key=lambda s: s.start_ns):
+        if timings_format == "json":
+            click.echo(json.dumps(span.to_dict()), err=True)
+        else:
+            processed = f"{span.nbytes / span.seconds / 1e6:.1f} MB/s" if span.nbytes and span.seconds else ""
+            click.echo(f"{'  ' * span.depth + span.name:<40} {span.seconds * 1e3:>10.1f} ms {processed:>14}", err=True)
+
+
+def record_output(ctx: click.Context, _: click.Parameter, value: Optional[str]) -> Optional[str]:
+    """Callback of the --output options, remembering the path so --profile can write its reports next to it."""
+    if value and value != "-":
+        ctx.find_root().meta["output_path"] = value
+    return value
+
+
+def write_profile(ctx: click.Context, profile: profiling.Profile) -> None:
+    path_prefix = ctx.meta.get("output_path") or f"hidestream-{ctx.invoked_subcommand}"
+    stats_path, report_path = profile.stop(path_prefix)
+    click.echo(f"Profile written to {stats_path}, allocations to {report_path}", err=True)
+
+
 @click.group()
 @click.version_option()
-def main() -> None:
+@click.option("--timings", "timings_format", type=click.Choice(["text", "json"]),
+              help="Write the time taken by each phase to stderr, as text or JSON lines")
+@click.option("--profile", is_flag=True,
+              help="Profile the command, writing <output>.prof and an <output>.alloc.txt allocation report")
+@click.option("--profile-top", default=profiling.DEFAULT_TOP, show_default=True, type=click.IntRange(1),
+              help="Allocation sites listed with --profile")
+@click.pass_context
+def main(ctx: click.Context, timings_format: Optional[str], profile: bool, profile_top: int) -> None:
     """Console script for HideStream."""
+    if timings_format:
+        spans = ctx.with_resource(timing.collect())
+        ctx.call_on_close(lambda: echo_timings(spans, timings_format))
+    if profile:
+        command_profile = profiling.Profile(profile_top)
+        command_profile.start()
+        ctx.call_on_close(lambda: write_profile(ctx, command_profile))
 
 
 @main.command(context_settings=dict(max_content_width=120))
@@ -88,22 +181,28 @@ def main() -> None:
               help="Print how much data can be hidden within an image")
 @click.option("--input", "-i", "input_fp", help="Path to a bitmap (.bmp or .png) image")
 @click.option("--secret", "-s", "secret_fp", help="Path to a file to hide in the image")
-@click.option("--output", "-o", "output_fp", help="Path to an output file")
+@click.option("--output", "-o", "output_fp", callback=record_output, help="Path to an output file")
 @click.option("--lsb-count", "-n", default=2, show_default=True, help="How many LSBs to use", type=int)
 @click.option("--compression", "-c", help="1 (best speed) to 9 (smallest file size)", default=1, show_default=True,
               type=click.IntRange(1, 9))
+@click.option("--in-place", is_flag=True,
+              help="Copy an uncompressed .bmp and patch only the pixels holding the data")
+@click.option("--jobs", "-j", default=1, show_default=True, type=int, help="Threads to use, 0 for one per core")
+@click.option("--png-jobs", default=1, show_default=True, type=int,
+              help="Threads to encode a .png output with, 0 for one per core, 1 to leave it to Pillow")
 @click.pass_context
 def steglsb(ctx: click.Context, hide: bool, recover: bool, analyze: bool, input_fp: str, secret_fp: str, output_fp: str,
-            lsb_count: int, compression: int) -> None:
+            lsb_count: int, compression: int, in_place: bool, jobs: int, png_jobs: int) -> None:
     """Hides or recovers data in and from an image"""
     try:
         if analyze:
             LSBSteg.analysis(input_fp, secret_fp, lsb_count)
 
         if hide:
-            LSBSteg.hide_data(input_fp, secret_fp, output_fp, lsb_count, compression)
+            LSBSteg.hide_data(input_fp, secret_fp, output_fp, lsb_count, compression, in_place=in_place, workers=jobs,
+                              png_workers=png_jobs)
         elif recover:
-            LSBSteg.recover_data(input_fp, output_fp, lsb_count)
+            LSBSteg.recover_data(input_fp, output_fp, lsb_count, jobs)
 
         if not hide and not recover and not analyze:
             click.echo(ctx.get_help())
@@ -115,32 +214,81 @@ def steglsb(ctx: click.Context, hide: bool, recover: bool, analyze: bool, input_
 @main.command()
 @click.option("--input", "-i", "image_path", help="Path to an image")
 @click.option("--lsb-count", "-n", default=2, show_default=2, type=int, help="How many LSBs to display")
+@click.option("--entropy", "-e", is_flag=True, help="Also run a reverse entropy analysis of the image")
+@click.option("--plot", is_flag=True, help="Plot the block entropy distribution (with --entropy)")
+@click.option("--jobs", "-j", default=1, show_default=True, type=click.IntRange(1),
+              help="Processes to run the entropy analysis on")
 @click.pass_context
-def stegdetect(ctx: click.Context, image_path: str, lsb_count: int) -> None:
+def stegdetect(ctx: click.Context, image_path: str, lsb_count: int, entropy: bool, plot: bool, jobs: int) -> None:
     """Shows the n least significant bits of image"""
     if image_path:
         StegDetect.show_lsb(image_path, lsb_count)
+        if entropy:
+            result = reverse_entropy.scan(image_path, workers=jobs, plot=plot)
+            click.echo(f"Mean block entropy: {result.mean:.4f}, standard deviation: {result.std:.4f}\n"
+                       f"Anomalous blocks: {len(result.anomalies)}\n"
+                       f"Hidden data {'is likely' if result.hidden_data_likely else 'not detected'}")
     else:
         click.echo(ctx.get_help())
 
 
+@main.command("stegscan")
+@click.argument("patterns", nargs=-1, required=True)
+@click.option("--output", "-o", "output_fp", default="-", show_default=True, callback=record_output,
+              help="Path to write the results to as JSON lines, - for stdout")
+@click.option("--lsb-count", "-n", type=click.IntRange(1, 8),
+              help="Also save an image of this many LSBs of each file, as stegdetect does")
+@click.option("--maps-dir", default=stegscan.DEFAULT_MAPS_DIR, show_default=True,
+              help="Directory to save the images of --lsb-count to, which isn't scanned")
+@click.option("--block-size", default=8, show_default=True, type=click.IntRange(1),
+              help="Size of the square blocks of the entropy analysis")
+@click.option("--cache", "cache_fp", default=stegscan.DEFAULT_CACHE_PATH, show_default=True,
+              help="SQLite file caching the verdict of each file by content")
+@click.option("--no-cache", is_flag=True, help="Analyse every file, without reading or updating the cache")
+@click.option("--jobs", "-j", default=1, show_default=True, type=click.IntRange(1), help="Processes to use")
+def stegscan_command(patterns: Tuple[str, ...], output_fp: str, lsb_count: Optional[int], maps_dir: str,
+                     block_size: int, cache_fp: str, no_cache: bool, jobs: int) -> None:
+    """Runs the entropy analysis on every image in directories or globs"""
+    counts = {"files": 0, "cached": 0, "likely": 0, "errors": 0}
+    with click.open_file(output_fp, "w") as output:
+        for result in stegscan.scan(patterns, jobs, (block_size, block_size), lsb_count,
+                                    None if no_cache else cache_fp, maps_dir):
+            output.write(json.dumps(result) + "\n")
+            counts["files"] += 1
+            counts["cached"] += result["cached"]
+            counts["likely"] += result.get("hidden_data_likely", False)
+            counts["errors"] += "error" in result
+    click.echo(f"Scanned {counts['files']} files ({counts['cached']} cached): hidden data likely in "
+               f"{counts['likely']}, {counts['errors']} errors", err=True)
+
+
 @main.command()
 @click.option("--hide", "-h", is_flag=True, help="To hide data in a sound file")
 @click.option("--recover", "-r", is_flag=True, help="To recover data from a sound file")
 @click.option("--input", "-i", "input_fp", help="Path to a .wav file")
 @click.option("--secret", "-s", "secret_fp", help="Path to a file to hide in the sound file")
-@click.option("--output", "-o", "output_fp", help="Path to an output file")
+@click.option("--output", "-o", "output_fp", callback=record_output, help="Path to an output file")
 @click.option("--lsb-count", "-n", default=2, show_default=True, help="How many LSBs to use", type=int)
-@click.option("--bytes", "-b", "num_bytes", help="How many bytes to recover from the sound file", type=int)
+@click.option("--bytes", "-b", "num_bytes", type=int,
+              help="How many bytes to recover, only needed for files hidden with --no-header")
+@click.option("--no-header", is_flag=True, help="Don't hide the size of the data and the LSB count before it")
+@click.option("--stream", is_flag=True, help="Process the sound file in chunks instead of loading it into memory")
+@click.option("--chunk-frames", default=WavSteg.DEFAULT_CHUNK_FRAMES, show_default=True, type=click.IntRange(1),
+              help="How many frames to process at once with --stream")
+@click.option("--in-place", is_flag=True, help="Copy the sound file and patch only the samples holding the data")
+@click.option("--jobs", "-j", default=1, show_default=True, type=int, help="Threads to use, 0 for one per core")
 @click.pass_context
 def wavsteg(ctx: click.Context, hide: bool, recover: bool, input_fp: str, secret_fp: str, output_fp: str,
-            lsb_count: int, num_bytes: int) -> None:
+            lsb_count: int, num_bytes: int, no_header: bool, stream: bool, chunk_frames: int, in_place: bool,
+            jobs: int) -> None:
     """Hides or recovers data in and from a sound file"""
+    chunk_frames = chunk_frames if stream else None
     try:
         if hide:
-            WavSteg.hide_data(input_fp, secret_fp, output_fp, lsb_count)
+            WavSteg.hide_data(input_fp, secret_fp, output_fp, lsb_count, chunk_frames, in_place, jobs,
+                              header=not no_header)
         elif recover:
-            WavSteg.recover_data(input_fp, output_fp, lsb_count, num_bytes)
+            WavSteg.recover_data(input_fp, output_fp, lsb_count, num_bytes, chunk_frames, jobs)
         else:
             click.echo(ctx.get_help())
     except ValueError as e:
@@ -153,7 +301,7 @@ def wavsteg(ctx: click.Context, hide: bool, recover: bool, input_fp: str, secret
 @click.option("--reveal", "-r", is_flag=True, help="To extract a hidden file from an MP3 file")
 @click.option("--input", "-i", "input_fp", help="Path to the input MP3 file")
 @click.option("--secret", "-s", "secret_fp", help="Path to the file to hide (required for hiding)", default=None)
-@click.option("--output", "-o", "output_fp", help="Path to the output file")
+@click.option("--output", "-o", "output_fp", callback=record_output, help="Path to the output file")
 @click.pass_context
 def mp3steg(ctx: click.Context, hide: bool, reveal: bool, input_fp: str, secret_fp: str, output_fp: str) -> None:
     """Handles MP3 steganography operations using MP3hide.py"""
@@ -172,11 +320,97 @@ def mp3steg(ctx: click.Context, hide: bool, reveal: bool, input_fp: str, secret_
         click.echo(ctx.get_help())
 
 
+def write_job_results(results: Iterator[Dict[str, Any]], output_fp: str) -> None:
+    """Writes the results of batch jobs as JSON lines, logging failures, and exits with 1 if any job failed."""
+    counts = {"ok": 0, "failed": 0}
+    with click.open_file(output_fp, "w") as output:
+        for result in results:
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+            counts[result["status"]] += 1
+            if result["status"] == "failed":
+                log.error(f"Job {result.get('id')} failed: {result['error']}")
+    click.echo(f"{counts['ok']} jobs succeeded, {counts['failed']} failed", err=True)
+    if counts["failed"]:
+        raise SystemExit(1)
+
+
+@main.command("batch")
+@click.argument("manifest_fp", metavar="MANIFEST", type=click.Path(exists=True, dir_okay=False))
+@click.option("--output", "-o", "output_fp", default="-", show_default=True, callback=record_output,
+              help="Path to write the results to as JSON lines, - for stdout")
+@click.option("--jobs", "-j", default=1, show_default=True, type=click.IntRange(1), help="Processes to use")
+@click.option("--retries", default=1, show_default=True, type=click.IntRange(0),
+              help="How many times to retry jobs failing with a transient I/O error")
+def batch_command(manifest_fp: str, output_fp: str, jobs: int, retries: int) -> None:
+    """Runs the hide, recover and detect jobs of a CSV or JSON lines manifest"""
+    write_job_results(batch.run_batch(batch.read_manifest(manifest_fp), jobs, retries), output_fp)
+
+
+def import_serve() -> ModuleType:
+    """Imports serve, which needs Unix sockets, on the first use of its commands."""
+    if not hasattr(socket, "AF_UNIX"):
+        raise click.ClickException("The serve and client commands need Unix sockets, which this platform lacks")
+    import serve
+    return serve
+
+
+@main.command("serve")
+@click.option("--socket", "socket_fp", show_default="a socket in a directory private to the user",
+              help="Path of the Unix socket to listen on")
+@click.option("--jobs", "-j", default=1, show_default=True, type=click.IntRange(1), help="Worker processes to use")
+@click.option("--queue-size", type=click.IntRange(0),
+              help="Jobs queued per worker before clients are held back")
+def serve_command(socket_fp: Optional[str], jobs: int, queue_size: Optional[int]) -> None:
+    """Runs batch jobs sent to a Unix socket on warm worker processes"""
+    serve = import_serve()
+    try:
+        serve.serve(socket_fp or serve.DEFAULT_SOCKET_PATH, jobs,
+                    serve.DEFAULT_QUEUE_SIZE if queue_size is None else queue_size)
+    except OSError as e:
+        raise click.ClickException(str(e))
+
+
+@main.command()
+@click.argument("manifest_fp", metavar="MANIFEST", type=click.Path(exists=True, dir_okay=False))
+@click.option("--socket", "socket_fp", show_default="the serve command's",
+              help="Path of the socket the server listens on")
+@click.option("--output", "-o", "output_fp", default="-", show_default=True, callback=record_output,
+              help="Path to write the results to as JSON lines, - for stdout")
+def client(manifest_fp: str, socket_fp: Optional[str], output_fp: str) -> None:
+    """Sends the jobs of a manifest to a running serve command"""
+    serve = import_serve()
+    socket_fp = socket_fp or serve.DEFAULT_SOCKET_PATH
+    try:
+        write_job_results(serve.request(batch.read_manifest(manifest_fp), socket_fp), output_fp)
+    except (ConnectionRefusedError, FileNotFoundError):
+        raise click.ClickException(f"No server is listening on {socket_fp}, start one with the serve command")
+
+
 @main.command()
 def test() -> None:
     """Runs a performance test and verifies decoding consistency"""
     bit_manipulation.test()
 
 
+@main.command()
+@click.option("--case", "cases", multiple=True,
+              type=click.Choice([*benchmark.IMPORT_CASES, *benchmark.LATENCY_CASES, *benchmark.CASES]),
+              help="Case to run, may be repeated  [default: all]")
+@click.option("--size", "sizes", multiple=True, type=click.Choice(list(benchmark.SIZES)),
+              help="Carrier size to run, may be repeated  [default: all]")
+@click.option("--repeat", default=3, show_default=True, type=click.IntRange(1), help="Runs of each case")
+@click.option("--output", "-o", "output_fp", help="Path to save the results to as JSON")
+@click.option("--baseline", "baseline_fp", type=click.Path(exists=True, dir_okay=False),
+              help="JSON results to compare against, exits with 1 on regressions")
+@click.option("--tolerance", default=benchmark.DEFAULT_TOLERANCE, show_default=True, type=click.FloatRange(0),
+              help="Relative slowdown or memory growth allowed before a regression is reported")
+def bench(cases: Tuple[str, ...], sizes: Tuple[str, ...], repeat: int, output_fp: str, baseline_fp: str,
+          tolerance: float) -> None:
+    """Benchmarks every codec end to end on synthetic carriers"""
+    if not benchmark.benchmark(cases, sizes, repeat, output_fp, baseline_fp, tolerance):
+        raise SystemExit(1)
+
+
 if __name__ == "__main__":
     main()
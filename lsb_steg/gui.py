@@ -2,6 +2,7 @@ import tkinter as tk
 from tkinter import filedialog, messagebox, simpledialog, ttk, scrolledtext
 import threading
 import logging
+import os
 import sys
 import io
 
@@ -9,6 +10,7 @@ import LSBSteg
 import WavSteg
 import StegDetect
 from MP3hide import hide_file_in_mp3, reveal_file_from_mp3
+from progress import CancelToken, Cancelled
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
@@ -16,12 +18,18 @@ logger = logging.getLogger(__name__)
 
 
 class RedirectedIO(io.StringIO):
-    """Custom class to redirect stdout and stderr to a Tkinter widget."""
+    """Custom class to redirect stdout and stderr to a Tkinter widget.
+
+    Writes may come from the task threads, so the widget is only updated from the Tk event loop."""
     def __init__(self, widget, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.widget = widget
 
     def write(self, msg):
+        self.widget.after(0, self.insert, msg)
+        return len(msg)
+
+    def insert(self, msg):
         self.widget.config(state="normal")
         self.widget.insert(tk.END, msg)
         self.widget.see(tk.END)
@@ -38,6 +46,7 @@ class StegApp:
         self.root.geometry("800x600")
 
         self.progress_var = tk.DoubleVar()
+        self.cancel_token = None
 
         self.create_main_menu()
         self.create_console()
@@ -67,16 +76,29 @@ class StegApp:
         self.console_text = scrolledtext.ScrolledText(self.console_frame, height=10, state="disabled")
         self.console_text.pack(fill=tk.BOTH, expand=True)
 
-        self.progress_bar = ttk.Progressbar(self.console_frame, variable=self.progress_var, maximum=100)
-        self.progress_bar.pack(fill=tk.X, pady=5)
+        progress_frame = tk.Frame(self.console_frame)
+        progress_frame.pack(fill=tk.X, pady=5)
+        self.cancel_button = tk.Button(progress_frame, text="Cancel", command=self.cancel_task, state="disabled")
+        self.cancel_button.pack(side=tk.RIGHT, padx=5)
+        self.progress_bar = ttk.Progressbar(progress_frame, variable=self.progress_var, maximum=100)
+        self.progress_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
 
         # Redirect stdout and stderr to console
         sys.stdout = RedirectedIO(self.console_text)
         sys.stderr = RedirectedIO(self.console_text)
 
     def update_progress(self, value):
-        self.progress_var.set(value)
-        self.root.update_idletasks()
+        # called from the task threads, so the widgets are only touched from the Tk event loop
+        self.root.after(0, self.progress_var.set, value)
+
+    def report_progress(self, done, total):
+        """Progress callback passed to the codecs."""
+        self.update_progress(100 * done / total if total else 100)
+
+    def cancel_task(self):
+        if self.cancel_token is not None:
+            print("Cancelling...")
+            self.cancel_token.cancel()
 
     def clear_ui(self):
         for widget in self.main_frame.winfo_children():
@@ -96,6 +118,36 @@ class StegApp:
         thread = threading.Thread(target=func, daemon=True)
         thread.start()
 
+    def run_task(self, work, output_file, success_message):
+        """Runs work(progress, cancel) in a thread, showing its progress and enabling the cancel button
+        while it runs. The incomplete output_file is removed if it is cancelled."""
+        cancel = CancelToken()
+        self.cancel_token = cancel
+        self.cancel_button.config(state="normal")
+
+        def task():
+            try:
+                work(self.report_progress, cancel)
+                print(success_message)
+                self.root.after(0, messagebox.showinfo, "Success", success_message)
+            except Cancelled:
+                if os.path.exists(output_file):
+                    os.remove(output_file)
+                print("Cancelled")
+            except Exception as e:
+                print(f"Error: {e}")
+                self.root.after(0, messagebox.showerror, "Error", str(e))
+            finally:
+                self.update_progress(0)
+                self.root.after(0, self.task_finished, cancel)
+
+        self.run_in_thread(task)
+
+    def task_finished(self, cancel):
+        if self.cancel_token is cancel:
+            self.cancel_token = None
+            self.cancel_button.config(state="disabled")
+
     # MP3 Menu
     def mp3_steg_ui(self):
         self.clear_ui()
@@ -115,21 +167,9 @@ class StegApp:
         if not output_file:
             return
 
-        def task():
-            try:
-                self.update_progress(10)
-                print("Hiding data in MP3 file...")
-                hide_file_in_mp3(input_file, secret_file, output_file)
-                self.update_progress(100)
-                print(f"Data hidden successfully in {output_file}")
-                messagebox.showinfo("Success", f"Data hidden successfully in {output_file}")
-            except Exception as e:
-                print(f"Error: {e}")
-                messagebox.showerror("Error", str(e))
-            finally:
-                self.update_progress(0)
-
-        self.run_in_thread(task)
+        print("Hiding data in MP3 file...")
+        self.run_task(lambda progress, cancel: hide_file_in_mp3(input_file, secret_file, output_file, progress, cancel),
+                      output_file, f"Data hidden successfully in {output_file}")
 
     def mp3_reveal_ui(self):
         input_file = self.file_dialog("Select Steganographed MP3 File", "*.mp3")
@@ -139,21 +179,9 @@ class StegApp:
         if not output_file:
             return
 
-        def task():
-            try:
-                self.update_progress(10)
-                print("Revealing hidden data from MP3 file...")
-                reveal_file_from_mp3(input_file, output_file)
-                self.update_progress(100)
-                print(f"Data extracted successfully to {output_file}")
-                messagebox.showinfo("Success", f"Data extracted successfully to {output_file}")
-            except Exception as e:
-                print(f"Error: {e}")
-                messagebox.showerror("Error", str(e))
-            finally:
-                self.update_progress(0)
-
-        self.run_in_thread(task)
+        print("Revealing hidden data from MP3 file...")
+        self.run_task(lambda progress, cancel: reveal_file_from_mp3(input_file, output_file, progress, cancel),
+                      output_file, f"Data extracted successfully to {output_file}")
 
     # Image Menu
     def image_steg_ui(self):
@@ -178,20 +206,10 @@ class StegApp:
         if lsb_count is None:
             return
 
-        def task():
-            try:
-                self.update_progress(10)
-                LSBSteg.hide_data(input_file, secret_file, output_file, lsb_count, compression_level=1)
-                self.update_progress(100)
-                print(f"Data hidden successfully in {output_file}")
-                messagebox.showinfo("Success", f"Data hidden successfully in {output_file}")
-            except Exception as e:
-                print(f"Error: {e}")
-                messagebox.showerror("Error", str(e))
-            finally:
-                self.update_progress(0)
-
-        self.run_in_thread(task)
+        self.run_task(lambda progress, cancel: LSBSteg.hide_data(input_file, secret_file, output_file, lsb_count,
+                                                                 compression_level=1, progress=progress,
+                                                                 cancel=cancel),
+                      output_file, f"Data hidden successfully in {output_file}")
 
     def image_reveal_ui(self):
         input_file = self.file_dialog("Select Steganographed Image File", "*.png *.bmp")
@@ -204,20 +222,9 @@ class StegApp:
         if lsb_count is None:
             return
 
-        def task():
-            try:
-                self.update_progress(10)
-                LSBSteg.recover_data(input_file, output_file, lsb_count)
-                self.update_progress(100)
-                print(f"Data extracted successfully to {output_file}")
-                messagebox.showinfo("Success", f"Data extracted successfully to {output_file}")
-            except Exception as e:
-                print(f"Error: {e}")
-                messagebox.showerror("Error", str(e))
-            finally:
-                self.update_progress(0)
-
-        self.run_in_thread(task)
+        self.run_task(lambda progress, cancel: LSBSteg.recover_data(input_file, output_file, lsb_count,
+                                                                    progress=progress, cancel=cancel),
+                      output_file, f"Data extracted successfully to {output_file}")
 
     def image_analyze_ui(self):
         input_file = self.file_dialog("Select Image File for Analysis", "*.png *.bmp")
@@ -231,10 +238,11 @@ class StegApp:
             try:
                 StegDetect.show_lsb(input_file, lsb_count)
                 print("Image analysis completed. Check the generated image.")
-                messagebox.showinfo("Success", "Image analysis completed. Check the generated image.")
+                self.root.after(0, messagebox.showinfo, "Success",
+                                "Image analysis completed. Check the generated image.")
             except Exception as e:
                 print(f"Error: {e}")
-                messagebox.showerror("Error", str(e))
+                self.root.after(0, messagebox.showerror, "Error", str(e))
 
         self.run_in_thread(task)
 
@@ -260,20 +268,11 @@ class StegApp:
         if lsb_count is None:
             return
 
-        def task():
-            try:
-                self.update_progress(10)
-                WavSteg.hide_data(input_file, secret_file, output_file, lsb_count)
-                self.update_progress(100)
-                print(f"Data hidden successfully in {output_file}")
-                messagebox.showinfo("Success", f"Data hidden successfully in {output_file}")
-            except Exception as e:
-                print(f"Error: {e}")
-                messagebox.showerror("Error", str(e))
-            finally:
-                self.update_progress(0)
-
-        self.run_in_thread(task)
+        # streamed in blocks, so progress is reported as it goes
+        self.run_task(lambda progress, cancel: WavSteg.hide_data(input_file, secret_file, output_file, lsb_count,
+                                                                 WavSteg.DEFAULT_CHUNK_FRAMES, progress=progress,
+                                                                 cancel=cancel),
+                      output_file, f"Data hidden successfully in {output_file}")
 
     def wav_reveal_ui(self):
         input_file = self.file_dialog("Select Steganographed WAV File", "*.wav")
@@ -285,24 +284,15 @@ class StegApp:
         lsb_count = simpledialog.askinteger("LSB Count", "Enter number of LSBs used during hiding (1-8):", minvalue=1, maxvalue=8)
         if lsb_count is None:
             return
-        bytes_to_recover = simpledialog.askinteger("Bytes to Recover", "Enter the number of bytes to recover:")
-        if bytes_to_recover is None:
-            return
+        # files hidden with a header know their own size, so this may be left empty
+        bytes_to_recover = simpledialog.askinteger("Bytes to Recover",
+                                                   "Enter the number of bytes to recover\n"
+                                                   "(cancel if the data was hidden with a header):")
 
-        def task():
-            try:
-                self.update_progress(10)
-                WavSteg.recover_data(input_file, output_file, lsb_count, bytes_to_recover)
-                self.update_progress(100)
-                print(f"Data extracted successfully to {output_file}")
-                messagebox.showinfo("Success", f"Data extracted successfully to {output_file}")
-            except Exception as e:
-                print(f"Error: {e}")
-                messagebox.showerror("Error", str(e))
-            finally:
-                self.update_progress(0)
-
-        self.run_in_thread(task)
+        self.run_task(lambda progress, cancel: WavSteg.recover_data(input_file, output_file, lsb_count,
+                                                                    bytes_to_recover, WavSteg.DEFAULT_CHUNK_FRAMES,
+                                                                    progress=progress, cancel=cancel),
+                      output_file, f"Data extracted successfully to {output_file}")
 
     # Detection Menu
     def steg_detect_ui(self):
@@ -324,10 +314,11 @@ class StegApp:
                 print(f"Analyzing image {input_file} with {lsb_count} LSBs...")
                 StegDetect.show_lsb(input_file, lsb_count)
                 print("Image analysis completed. Check the generated image.")
-                messagebox.showinfo("Success", "Image analysis completed. Check the generated image.")
+                self.root.after(0, messagebox.showinfo, "Success",
+                                "Image analysis completed. Check the generated image.")
             except Exception as e:
                 print(f"Error: {e}")
-                messagebox.showerror("Error", str(e))
+                self.root.after(0, messagebox.showerror, "Error", str(e))
 
         self.run_in_thread(task)
 
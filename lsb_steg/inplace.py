@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+    hide_stream.inplace
+    ~~~~~~~~~~~~~~~~~~~
+
+    Helpers for patching uncompressed carriers (WAV, BMP) in place:
+    the carrier is cloned to the output path and only the bytes which
+    hold the payload are rewritten through a memory map.
+
+    :copyright: (c) 2015 by R433.
+    :license: MIT License, see LICENSE.md for more details.
+"""
+import logging
+import mmap
+import shutil
+from contextlib import contextmanager
+from typing import Iterator
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+# ioctl request to share the extents of one file with another (Linux btrfs/xfs reflinks)
+FICLONE = 0x40049409
+
+
+def clone_file(src_path: str, dst_path: str) -> None:
+    """Copies the file at src_path to dst_path, sharing extents with a reflink where the filesystem supports it."""
+    if fcntl is not None:
+        with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return
+            except OSError:
+                log.debug("Reflink not supported, copying instead")
+    # shutil uses sendfile/copy_file_range where available, so the data doesn't pass through Python
+    shutil.copyfile(src_path, dst_path)
+
+
+@contextmanager
+def map_bytes(path: str, offset: int, length: int) -> Iterator[np.ndarray]:
+    """Yields a writable uint8 array of length bytes starting at offset, backed by a memory map of the file at path.
+
+    Changes to the array are written to the file. The map is closed once the
+    array and every view of it have been garbage collected."""
+    with open(path, "r+b") as file:
+        mapped = mmap.mmap(file.fileno(), 0)
+    try:
+        yield np.frombuffer(mapped, dtype=np.uint8, count=length, offset=offset)
+    finally:
+        mapped.flush()
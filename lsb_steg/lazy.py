@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+    hide_stream.lazy
+    ~~~~~~~~~~~~~~~~
+
+    Deferred imports of heavy dependencies, so that importing a module,
+    or starting the CLI, doesn't pay for libraries the command won't use.
+
+    :copyright: (c) 2015 by R433.
+    :license: MIT License, see LICENSE.md for more details.
+"""
+import importlib.util
+import sys
+from types import ModuleType
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Returns the module called name, which is only executed when one of its attributes is first used.
+
+    Parent packages are imported right away, so name should be a light package
+    or a submodule of one, e.g. PIL.Image. Raises ModuleNotFoundError if the
+    module isn't installed."""
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    parent, _, child = name.rpartition(".")
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
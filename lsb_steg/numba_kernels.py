@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+    hide_stream.numba_kernels
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    The kernels of the numba backend of :mod:`bit_manipulation`. They live
+    in their own module so numba is only imported when they are first used.
+
+    :copyright: (c) 2015 by R433.
+    :license: MIT License, see LICENSE.md for more details.
+"""
+import os
+
+from numba import config, njit, prange
+
+# With TBB, numba's first choice, the interpreter hangs at exit once a kernel has been launched
+# outside the main thread (as the aio module does), so OpenMP is preferred unless a layer was chosen
+if "NUMBA_THREADING_LAYER" not in os.environ and "NUMBA_THREADING_LAYER_PRIORITY" not in os.environ:
+    config.THREADING_LAYER_PRIORITY = ["omp", "tbb", "workqueue"]
+
+
+# cache=True stores the compiled kernels in __pycache__, so only the first run pays for compilation
+@njit(parallel=True, cache=True)
+def interleave_kernel(carrier, payload, num_lsb, byte_depth, out):  # type: ignore
+    plen = payload.shape[0]
+    mask = (1 << num_lsb) - 1
+    for i in prange(out.shape[0] // byte_depth):
+        # the num_lsb bits for this value lie within a 16 bit window of the payload
+        bit_pos = i * num_lsb
+        byte_pos = bit_pos >> 3
+        window = payload[byte_pos] << 8
+        if byte_pos + 1 < plen:
+            window |= payload[byte_pos + 1]
+        value = (window >> (16 - (bit_pos & 7) - num_lsb)) & mask
+        lsb_byte = (i + 1) * byte_depth - 1
+        for j in range(i * byte_depth, lsb_byte):
+            out[j] = carrier[j]
+        out[lsb_byte] = (carrier[lsb_byte] & (0xFF ^ mask)) | value
+
+
+@njit(parallel=True, cache=True)
+def deinterleave_kernel(carrier, num_lsb, byte_depth, out):  # type: ignore
+    mask = (1 << num_lsb) - 1
+    for i in prange(out.shape[0]):
+        # collect the values holding bits 8 * i to 8 * i + 7, skipping the bits of the previous byte
+        value_pos = (8 * i) // num_lsb
+        num_bits = num_lsb * (value_pos + 1) - 8 * i
+        acc = carrier[(value_pos + 1) * byte_depth - 1] & ((1 << num_bits) - 1)
+        while num_bits < 8:
+            value_pos += 1
+            acc = (acc << num_lsb) | (carrier[(value_pos + 1) * byte_depth - 1] & mask)
+            num_bits += num_lsb
+        out[i] = acc >> (num_bits - 8)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+    hide_stream.pngwriter
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    A PNG encoder which filters and deflates strips of rows on a thread
+    pool, in the way pigz compresses gzip streams, for large steganographed
+    images whose single threaded encoding would dominate the time taken.
+
+    Each strip is compressed as raw deflate primed with the last 32 KiB of
+    the strip before it, and ends on a byte boundary with a sync flush, so
+    the strips join into a single zlib stream and the file is a standard
+    PNG. Their Adler-32 checksums are combined for the stream's trailer.
+    zlib and NumPy release the GIL, so the strips are processed in parallel.
+
+    :copyright: (c) 2015 by R433.
+    :license: MIT License, see LICENSE.md for more details.
+"""
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, List, Optional, Tuple, Union
+
+import numpy as np
+
+from bit_manipulation import resolve_workers
+from lazy import lazy_import
+
+Image = lazy_import("PIL.Image")
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# PNG color types of the 8 bit modes written here
+COLOR_TYPES = {"L": 0, "RGB": 2, "LA": 4, "RGBA": 6}
+
+# Bytes of filtered rows per strip compressed on its own
+STRIP_SIZE = 1 << 20
+
+# The deflate window, the part of the previous strip each strip is primed with
+WINDOW_SIZE = 1 << 15
+
+ADLER_BASE = 65521
+
+# PNG filter types
+FILTER_NONE = 0
+FILTER_PAETH = 4
+
+
+def supports(image: Image.Image) -> bool:
+    """Returns whether image can be written by save, other images are left to Pillow."""
+    return image.mode in COLOR_TYPES and not getattr(image, "is_animated", False)
+
+
+def chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def adler32_combine(adler1: int, adler2: int, length2: int) -> int:
+    """Returns the Adler-32 of two pieces of data given that of each, and the length of the second,
+    as zlib's adler32_combine does."""
+    remainder = length2 % ADLER_BASE
+    sum1 = adler1 & 0xFFFF
+    sum2 = remainder * sum1 % ADLER_BASE
+    sum1 = (sum1 + (adler2 & 0xFFFF) + ADLER_BASE - 1) % ADLER_BASE
+    sum2 = (sum2 + (adler1 >> 16) + (adler2 >> 16) + ADLER_BASE - remainder) % ADLER_BASE
+    return sum1 | sum2 << 16
+
+
+def zlib_header(compress_level: int) -> bytes:
+    """Returns the two byte zlib header of a stream compressed at compress_level with a 32 KiB window."""
+    method_info = 0x78
+    level_flag = 0 if compress_level < 2 else 1 if compress_level < 6 else 2 if compress_level == 6 else 3
+    flags = level_flag << 6
+    flags |= 31 - (method_info << 8 | flags) % 31
+    return bytes((method_info, flags))
+
+
+def filter_rows(rows: np.ndarray, previous_row: Optional[np.ndarray], bytes_per_pixel: int,
+                filter_type: int = FILTER_PAETH) -> np.ndarray:
+    """Returns the (rows, 1 + row bytes) filtered scanlines of the (rows, row bytes) uint8 array,
+    previous_row being the row before them, or None for the first row of the image."""
+    filtered = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+    filtered[:, 0] = filter_type
+    if filter_type == FILTER_NONE:
+        filtered[:, 1:] = rows
+        return filtered
+
+    x = rows.astype(np.int16)
+    up = np.empty_like(x)
+    up[0] = 0 if previous_row is None else previous_row
+    up[1:] = x[:-1]
+    left = np.zeros_like(x)
+    left[:, bytes_per_pixel:] = x[:, :-bytes_per_pixel]
+    up_left = np.zeros_like(x)
+    up_left[:, bytes_per_pixel:] = up[:, :-bytes_per_pixel]
+
+    # the Paeth predictor: whichever of left, up and up left is closest to left + up - up left
+    distance_left = np.abs(up - up_left)
+    distance_up = np.abs(left - up_left)
+    distance_up_left = np.abs(left + up - 2 * up_left)
+    predictor = np.where((distance_left <= distance_up) & (distance_left <= distance_up_left), left,
+                         np.where(distance_up <= distance_up_left, up, up_left))
+    filtered[:, 1:] = x - predictor
+    return filtered
+
+
+def compress_strip(filtered: np.ndarray, primer: bytes, compress_level: int, last: bool) -> Tuple[bytes, int]:
+    """Returns the raw deflate data of the filtered strip, primed with primer, and the strip's Adler-32."""
+    data = memoryview(filtered).cast("B")
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -15, 9, zdict=primer) if primer \
+        else zlib.compressobj(compress_level, zlib.DEFLATED, -15, 9)
+    compressed = compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return compressed, zlib.adler32(data)
+
+
+def save(image: Image.Image, fp: Union[str, IO[bytes]], compress_level: int = 6, workers: int = 0,
+         filter_type: int = FILTER_PAETH) -> None:
+    """Writes image to fp, a path or a binary file, as a PNG compressed at compress_level (0 to 9)
+    on workers threads, < 1 for one per core. See supports for the images which can be written.
+
+    Only the ICC profile and the transparency of the image's info are kept, as Pillow
+    does when saving without extra options."""
+    if not supports(image):
+        raise ValueError(f"Images in mode {image.mode} can't be written by the parallel encoder")
+
+    width, height = image.size
+    bytes_per_pixel = len(image.mode)
+    rows = np.asarray(image).reshape(height, width * bytes_per_pixel)
+    strip_rows = max(1, STRIP_SIZE // (width * bytes_per_pixel + 1))
+    strips = [(top, min(top + strip_rows, height)) for top in range(0, height, strip_rows)]
+
+    def filter_strip(strip: Tuple[int, int]) -> np.ndarray:
+        top, bottom = strip
+        return filter_rows(rows[top:bottom], rows[top - 1] if top else None, bytes_per_pixel, filter_type)
+
+    with ThreadPoolExecutor(resolve_workers(workers)) as pool:
+        filtered = list(pool.map(filter_strip, strips))
+        primers = [b""] + [memoryview(strip).cast("B")[-WINDOW_SIZE:].tobytes() for strip in filtered[:-1]]
+        compressed = list(pool.map(compress_strip, filtered, primers, [compress_level] * len(strips),
+                                   [i == len(strips) - 1 for i in range(len(strips))]))
+
+    adler = 1
+    for strip, (_, strip_adler) in zip(filtered, compressed):
+        adler = adler32_combine(adler, strip_adler, strip.nbytes)
+
+    chunks: List[bytes] = [
+        PNG_SIGNATURE,
+        chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, COLOR_TYPES[image.mode], 0, 0, 0)),
+    ]
+    icc_profile = image.info.get("icc_profile")
+    if icc_profile:
+        chunks.append(chunk(b"iCCP", b"ICC Profile\0\0" + zlib.compress(icc_profile)))
+    transparency = image.info.get("transparency")
+    if image.mode == "L" and isinstance(transparency, int):
+        chunks.append(chunk(b"tRNS", struct.pack(">H", max(0, min(65535, transparency)))))
+    elif image.mode == "RGB" and isinstance(transparency, (list, tuple)) and len(transparency) == 3:
+        chunks.append(chunk(b"tRNS", struct.pack(">HHH", *transparency)))
+
+    idat = [zlib_header(compress_level)] + [data for data, _ in compressed] + [struct.pack(">I", adler)]
+    chunks.extend(chunk(b"IDAT", data) for data in idat)
+    chunks.append(chunk(b"IEND", b""))
+
+    if isinstance(fp, str):
+        with open(fp, "wb") as file:
+            file.writelines(chunks)
+    else:
+        fp.writelines(chunks)
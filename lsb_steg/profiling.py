@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+    hide_stream.profiling
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    cProfile and tracemalloc reports of a whole command, as written by
+    the CLI's --profile option.
+
+    :copyright: (c) 2015 by R433.
+    :license: MIT License, see LICENSE.md for more details.
+"""
+import cProfile
+import tracemalloc
+from typing import Optional, Tuple
+
+import timing
+
+# Allocation sites listed in the report by default
+DEFAULT_TOP = 25
+
+# Allocations made by the machinery rather than by the command itself
+IGNORED_TRACES = (
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+    tracemalloc.Filter(False, tracemalloc.__file__),
+)
+
+
+class Profile:
+    """Profiles the time and memory spent between start() and stop().
+
+    Only the calling thread is seen by cProfile, tracemalloc sees every
+    thread. Memory is mostly freed by the time a command finishes, so the
+    allocation sites are reported as they were at the end of the timing
+    span which left the most memory allocated."""
+
+    def __init__(self, top: int = DEFAULT_TOP) -> None:
+        self.top = top
+        self.profiler = cProfile.Profile()
+        self.snapshot: Optional[tracemalloc.Snapshot] = None
+        self.snapshot_span = ""
+        self.snapshot_size = -1
+
+    def _on_span(self, span: timing.Span) -> None:
+        current, _ = tracemalloc.get_traced_memory()
+        if current > self.snapshot_size:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshot_span = span.path
+            self.snapshot_size = current
+
+    def start(self) -> None:
+        tracemalloc.start()
+        timing.add_collector(self._on_span)
+        self.profiler.enable()
+
+    def stop(self, path_prefix: str) -> Tuple[str, str]:
+        """Stops profiling and writes the pstats file and the allocation report,
+        returning their paths, path_prefix followed by .prof and .alloc.txt."""
+        self.profiler.disable()
+        timing.remove_collector(self._on_span)
+        self._on_span(timing.Span("end of the command", None))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stats_path = f"{path_prefix}.prof"
+        self.profiler.dump_stats(stats_path)
+
+        report_path = f"{path_prefix}.alloc.txt"
+        statistics = self.snapshot.filter_traces(IGNORED_TRACES).statistics("lineno")
+        with open(report_path, "w") as report:
+            report.write(f"Peak traced memory: {peak / 2 ** 20:.1f} MB\n"
+                         f"Top {self.top} allocation sites at the end of {self.snapshot_span} "
+                         f"({self.snapshot_size / 2 ** 20:.1f} MB allocated):\n\n")
+            for statistic in statistics[:self.top]:
+                report.write(f"{statistic.size / 2 ** 20:>10.2f} MB {statistic.count:>9} blocks  "
+                             f"{statistic.traceback[0]}\n")
+        return stats_path, report_path
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+    hide_stream.progress
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Progress reporting and cancellation for long running codec calls. The
+    hide and recover functions of LSBSteg, WavSteg and MP3hide take an
+    optional progress callback, called with the bytes processed so far and
+    the total after each chunk, and an optional CancelToken, checked before
+    each report, which stops them with Cancelled.
+
+    :copyright: (c) 2015 by R433.
+    :license: MIT License, see LICENSE.md for more details.
+"""
+import threading
+from typing import Callable, Optional
+
+# Called with the number of bytes processed so far and the total
+ProgressCallback = Callable[[int, int], None]
+
+
+class Cancelled(Exception):
+    """Raised by a codec whose CancelToken was cancelled. Its output is left incomplete."""
+
+
+class CancelToken:
+    """Cancels a codec call from another thread, which stops at its next chunk."""
+
+    def __init__(self) -> None:
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self) -> None:
+        """Raises Cancelled if the token was cancelled."""
+        if self._event.is_set():
+            raise Cancelled()
+
+
+def report(done: int, total: int, progress: Optional[ProgressCallback] = None,
+           cancel: Optional[CancelToken] = None) -> None:
+    """Called by the codecs after each chunk: raises Cancelled if cancel was cancelled,
+    otherwise passes done and total to progress."""
+    if cancel is not None:
+        cancel.check()
+    if progress is not None:
+        progress(done, total)
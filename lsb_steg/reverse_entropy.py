@@ -1,73 +1,193 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
 import numpy as np
-from PIL import Image
-from scipy.stats import entropy
-from numpy.lib.stride_tricks import as_strided
-from tqdm import tqdm
-import matplotlib.pyplot as plt
+
+from lazy import lazy_import
+from timing import span, timed
+
+Image = lazy_import("PIL.Image")
+
+# Block rows handed to a worker at once by scan()
+DEFAULT_STRIP_ROWS = 512
+
+# Result of scan(): the block entropy map, its statistics, the (row, column) of
+# blocks more than 2 standard deviations from the mean, and the verdict
+EntropyScan = namedtuple("EntropyScan", ["entropy_map", "mean", "std", "anomalies", "hidden_data_likely"])
 
 
 def calculate_entropy(data):
     """
     Calculate entropy of a 2D array (grayscale image block).
     """
+    from scipy.stats import entropy
+
     values, counts = np.unique(data, return_counts=True)
     probabilities = counts / counts.sum()
     return entropy(probabilities, base=2)
 
 
-def block_entropy_analysis(image_array, block_size):
+def blocks_entropy(blocks):
+    """
+    Calculate the entropy of every row of a 2D array of block values at once.
+
+    Sorting each row groups equal values into runs, so the count of every
+    distinct value is the length of its run and the entropy is
+    log2(m) - sum(c * log2(c)) / m for a block of m values with counts c.
+    """
+    num_blocks, block_len = blocks.shape
+    sorted_blocks = np.sort(blocks, axis=1)
+
+    # A run starts at the first value of each block and wherever the value changes
+    run_starts = np.ones(sorted_blocks.shape, dtype=bool)
+    run_starts[:, 1:] = sorted_blocks[:, 1:] != sorted_blocks[:, :-1]
+    run_starts = np.flatnonzero(run_starts)
+    counts = np.diff(np.append(run_starts, sorted_blocks.size)).astype(np.float64)
+
+    count_terms = np.bincount(run_starts // block_len, weights=counts * np.log2(counts), minlength=num_blocks)
+    # clip the tiny negative values rounding gives for blocks with a single value
+    return np.maximum(np.log2(block_len) - count_terms / block_len, 0.0)
+
+
+def block_entropy_analysis(image_array, block_size, rows_per_chunk=256):
     """
-    Perform block-wise entropy analysis using stride tricks with a progress bar.
+    Perform block-wise entropy analysis on non-overlapping blocks, rows_per_chunk block rows at a time.
     """
     h, w = image_array.shape
     bh, bw = block_size
 
     # Ensure image dimensions are multiples of block size for easy processing
-    h_trimmed = (h // bh) * bh
-    w_trimmed = (w // bw) * bw
-    image_array = image_array[:h_trimmed, :w_trimmed]
-
-    # Stride tricks to create non-overlapping blocks
-    shape = (h_trimmed // bh, w_trimmed // bw, bh, bw)
-    strides = (
-        bh * image_array.strides[0],
-        bw * image_array.strides[1],
-        image_array.strides[0],
-        image_array.strides[1],
-    )
-    blocks = as_strided(image_array, shape=shape, strides=strides)
-
-    # Calculate entropy for each block with progress bar
-    block_entropies = np.empty((blocks.shape[0], blocks.shape[1]))
-    for i in tqdm(range(blocks.shape[0]), desc="Analyzing Entropy Blocks"):
-        for j in range(blocks.shape[1]):
-            block_entropies[i, j] = calculate_entropy(blocks[i, j])
+    h_blocks = h // bh
+    w_blocks = w // bw
+
+    block_entropies = np.empty((h_blocks, w_blocks))
+    for top in range(0, h_blocks, rows_per_chunk):
+        bottom = min(top + rows_per_chunk, h_blocks)
+        # One row per block, holding the block's values
+        blocks = (image_array[top * bh:bottom * bh, :w_blocks * bw]
+                  .reshape(bottom - top, bh, w_blocks, bw)
+                  .swapaxes(1, 2)
+                  .reshape(-1, bh * bw))
+        block_entropies[top:bottom] = blocks_entropy(blocks).reshape(bottom - top, w_blocks)
     return block_entropies
 
 
-def reverse_entropy_analysis(image_path, block_size=(8, 8)):
+def _strip_entropy(shm_name, shape, block_size, top, bottom):
     """
-    Perform reverse entropy analysis on an image and determine if hidden data is likely present.
+    Worker for scan(): block entropies of block rows top to bottom of the grayscale image in shared memory.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    image_array = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    try:
+        bh = block_size[0]
+        return top, block_entropy_analysis(image_array[top * bh:bottom * bh], block_size)
+    finally:
+        # the shared memory can only be closed once no arrays use it
+        del image_array
+        shm.close()
+
+
+def read_grayscale(image, out, rows):
+    """
+    Convert image to grayscale into the uint8 array out of its (height, width), rows rows at a time,
+    so that no grayscale copy of the whole image is made on the way.
+    """
+    w, h = image.size
+    for top in range(0, h, rows):
+        bottom = min(top + rows, h)
+        out[top:bottom] = np.asarray(image.crop((0, top, w, bottom)).convert("L"))
+
+
+def _merge_statistics(count, mean, m2, values):
+    """
+    Merge the statistics of values into a running (count, mean, sum of squared deviations), see Chan et al.
+    """
+    values_count = values.size
+    if values_count == 0:
+        return count, mean, m2
+    values_mean = values.mean()
+    values_m2 = ((values - values_mean) ** 2).sum()
+    total = count + values_count
+    delta = values_mean - mean
+    return total, mean + delta * values_count / total, m2 + values_m2 + delta ** 2 * count * values_count / total
+
+
+def plot_entropy_distribution(block_entropies):
+    """
+    Show a histogram of the block entropies. matplotlib is only imported here.
     """
-    # Open image and convert to grayscale
-    image = Image.open(image_path).convert("L")
-    image_array = np.array(image)
+    import matplotlib.pyplot as plt
 
-    # Calculate entropy for each block
-    block_entropies = block_entropy_analysis(image_array, block_size)
+    plt.hist(block_entropies.flatten(), bins=30, color="blue", alpha=0.7)
+    plt.title("Entropy Distribution of Image Blocks")
+    plt.xlabel("Entropy")
+    plt.ylabel("Frequency")
+    plt.show()
+
+
+@timed("reverse_entropy.scan")
+def scan(image_path, block_size=(8, 8), workers=1, strip_rows=DEFAULT_STRIP_ROWS, plot=False):
+    """
+    Headless reverse entropy analysis, returning an EntropyScan instead of printing.
+
+    The image is split into horizontal strips of strip_rows block rows. With
+    workers > 1 the image is converted to grayscale straight into shared
+    memory, a strip at a time, and the strips are analysed by a process pool;
+    the mean and standard deviation are updated as each strip's results come in.
+    """
+    with Image.open(image_path) as image:
+        w, h = image.size
+    bh, bw = block_size
+    h_blocks = h // bh
+
+    block_entropies = np.empty((h_blocks, w // bw))
+    count, mean, m2 = 0, 0.0, 0.0
+    strips = [(top, min(top + strip_rows, h_blocks)) for top in range(0, h_blocks, strip_rows)]
+
+    if workers > 1 and len(strips) > 1:
+        shm = shared_memory.SharedMemory(create=True, size=max(h * w, 1))
+        try:
+            with span("Image read"), Image.open(image_path) as image:
+                read_grayscale(image, np.ndarray((h, w), dtype=np.uint8, buffer=shm.buf), strip_rows * bh)
+            with span("Block entropies", h * w), ProcessPoolExecutor(workers) as pool:
+                futures = [pool.submit(_strip_entropy, shm.name, (h, w), block_size, top, bottom)
+                           for top, bottom in strips]
+                for future in futures:
+                    top, strip_entropies = future.result()
+                    block_entropies[top:top + len(strip_entropies)] = strip_entropies
+                    count, mean, m2 = _merge_statistics(count, mean, m2, strip_entropies)
+        finally:
+            shm.close()
+            shm.unlink()
+    else:
+        with span("Image read"), Image.open(image_path) as image:
+            image_array = np.asarray(image.convert("L"))
+        with span("Block entropies", image_array.nbytes):
+            for top, bottom in strips:
+                strip_entropies = block_entropy_analysis(image_array[top * bh:bottom * bh], block_size)
+                block_entropies[top:bottom] = strip_entropies
+                count, mean, m2 = _merge_statistics(count, mean, m2, strip_entropies)
 
-    # Overall statistics
-    mean_entropy = np.mean(block_entropies)
-    std_dev_entropy = np.std(block_entropies)
+    std = float(np.sqrt(m2 / count)) if count else 0.0
+    anomalies = np.argwhere(np.abs(block_entropies - mean) > 2 * std)
+
+    if plot:
+        plot_entropy_distribution(block_entropies)
+    return EntropyScan(block_entropies, float(mean), std, anomalies, bool(anomalies.size > 0))
+
+
+def reverse_entropy_analysis(image_path, block_size=(8, 8), workers=1, plot=True):
+    """
+    Perform reverse entropy analysis on an image and determine if hidden data is likely present.
+    """
+    result = scan(image_path, block_size, workers)
+    block_entropies, mean_entropy, std_dev_entropy, anomalies, hidden_data_likely = result
 
     print(f"\nMean Block Entropy: {mean_entropy:.4f}")
     print(f"Entropy Standard Deviation: {std_dev_entropy:.4f}")
 
-    # Identify anomalies
-    anomalies = np.argwhere(np.abs(block_entropies - mean_entropy) > 2 * std_dev_entropy)
-
     # Analyze the anomalies
-    hidden_data_likely = anomalies.size > 0
     if hidden_data_likely:
         print(f"\nAnomalies detected in {len(anomalies)} blocks:")
         for anomaly in anomalies:
@@ -78,11 +198,9 @@ def reverse_entropy_analysis(image_path, block_size=(8, 8)):
         print("Conclusion: No hidden data detected in the image.")
 
     # Optional: Visualize entropy distribution
-    plt.hist(block_entropies.flatten(), bins=30, color="blue", alpha=0.7)
-    plt.title("Entropy Distribution of Image Blocks")
-    plt.xlabel("Entropy")
-    plt.ylabel("Frequency")
-    plt.show()
+    if plot:
+        plot_entropy_distribution(block_entropies)
+    return result
 
 
 # Usage Example
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+    hide_stream.serve
+    ~~~~~~~~~~~~~~~~~
+
+    A long-lived local service running the jobs of :mod:`batch` on a pool
+    of warm worker processes, so that a request only costs the codec's own
+    work rather than starting an interpreter and importing NumPy and PIL.
+
+    Clients connect to a Unix socket and send jobs as JSON lines, each of
+    which is answered with a JSON line holding the job and its result, in
+    the order the jobs finish. A job {"op": "ping"} is answered right away.
+    Only so many jobs are queued at once, past that the server stops
+    reading from clients until a worker is free.
+
+    Jobs read and write any path the server's user can, so the socket is
+    only accessible to that user, and by default lies in a private directory.
+
+    :copyright: (c) 2015 by R433.
+    :license: MIT License, see LICENSE.md for more details.
+"""
+import getpass
+import json
+import logging
+import os
+import queue
+import signal
+import socket
+import socketserver
+import stat
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+import batch
+
+__all__ = [
+    "SOCKET_DIR", "DEFAULT_SOCKET_PATH", "DEFAULT_QUEUE_SIZE", "init_worker", "JobHandler", "JobServer",
+    "make_private_dir", "remove_stale_socket", "serve", "request",
+]
+
+log = logging.getLogger(__name__)
+
+# $XDG_RUNTIME_DIR is private to the user, otherwise a private directory is made in the temporary directory
+SOCKET_DIR = os.environ.get("XDG_RUNTIME_DIR") or os.path.join(
+    tempfile.gettempdir(), f"hide_stream-{os.getuid() if hasattr(os, 'getuid') else getpass.getuser()}")
+DEFAULT_SOCKET_PATH = os.path.join(SOCKET_DIR, "hide_stream.sock")
+
+# Jobs queued per worker before the server stops reading requests
+DEFAULT_QUEUE_SIZE = 4
+
+
+def init_worker() -> None:
+    """Initializer of the worker processes, which leave Ctrl-C to the server so it can shut them down."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    batch.warm_up()
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """Handles one client connection, submitting its jobs as they are read and
+    writing each result from a writer thread once the job is done."""
+
+    server: "JobServer"
+
+    def handle(self) -> None:
+        results: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+        writer = threading.Thread(target=self.write_results, args=(results,), daemon=True)
+        writer.start()
+        pending = []
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    job = json.loads(line)
+                except ValueError as e:
+                    results.put({"status": "failed", "error": f"{type(e).__name__}: {e}"})
+                    continue
+                if not isinstance(job, dict):
+                    results.put({"status": "failed", "error": f"Jobs must be JSON objects, not {type(job).__name__}"})
+                    continue
+                if job.get("op") == "ping":
+                    results.put({**job, "status": "ok", "workers": self.server.workers})
+                    continue
+                future = self.server.submit(job, results.put)
+                if future is not None:
+                    pending.append(future)
+        finally:
+            for future in pending:
+                future.exception()
+            results.put(None)
+            writer.join()
+
+    def write_results(self, results: "queue.Queue[Optional[Dict[str, Any]]]") -> None:
+        for result in iter(results.get, None):
+            queued = result.pop("queued", False)
+            try:
+                self.wfile.write(json.dumps(result).encode() + b"\n")
+                self.wfile.flush()
+            except OSError:
+                log.debug("Client went away before reading its results")
+            finally:
+                if queued:
+                    self.server.slots.release()
+
+
+class JobServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves jobs from a Unix socket on a pool of workers, which are started and
+    warmed up before the socket is opened, and again if one of them dies."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH, workers: int = 1,
+                 queue_size: int = DEFAULT_QUEUE_SIZE) -> None:
+        if os.path.dirname(os.path.abspath(socket_path)) == os.path.abspath(SOCKET_DIR):
+            make_private_dir(SOCKET_DIR)
+        remove_stale_socket(socket_path)
+
+        self.workers = max(workers, 1)
+        # a slot is held from a job's submission until its result is written
+        self.slots = threading.BoundedSemaphore(self.workers * (queue_size + 1))
+        self.pool_lock = threading.Lock()
+        self.pool = self.start_pool()
+        try:
+            super().__init__(socket_path, JobHandler)
+        except BaseException:
+            self.pool.shutdown(cancel_futures=True)
+            raise
+
+    def start_pool(self) -> ProcessPoolExecutor:
+        """Returns a pool of workers, each of which has been warmed up."""
+        pool = ProcessPoolExecutor(self.workers, initializer=init_worker)
+        try:
+            for future in [pool.submit(os.getpid) for _ in range(self.workers)]:
+                future.result()
+        except BaseException:
+            pool.shutdown(cancel_futures=True)
+            raise
+        return pool
+
+    def restart_pool(self, broken: ProcessPoolExecutor) -> None:
+        """Replaces the pool broken by the death of one of its workers, unless another thread already did."""
+        with self.pool_lock:
+            if self.pool is not broken:
+                return
+            log.warning("A worker died, restarting the pool")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.pool = self.start_pool()
+
+    def server_bind(self) -> None:
+        # the socket is created with the permissions left by the umask, readable and writable by the user alone
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def submit(self, job: Dict[str, Any], on_result: Callable[[Dict[str, Any]], None]) -> Optional[Future]:
+        """Runs job on the pool, blocking while every slot is taken, and calls on_result with its result.
+
+        If the pool was broken by the death of a worker, it is restarted and job fails right away,
+        in which case None is returned."""
+        self.slots.acquire()
+        pool = self.pool
+        try:
+            future = pool.submit(batch._run_job, job)
+        except BrokenProcessPool as e:
+            self.slots.release()
+            on_result({**job, "status": "failed", "error": f"{type(e).__name__}: {e}"})
+            self.restart_pool(pool)
+            return None
+        except BaseException:
+            self.slots.release()
+            raise
+
+        def done(future: Future) -> None:
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+            result.pop("retryable", None)
+            on_result({**job, **result, "queued": True})
+
+        future.add_done_callback(done)
+        return future
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.pool.shutdown(cancel_futures=True)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def make_private_dir(path: str) -> None:
+    """Creates the directory at path accessible to the user alone, raising OSError if it
+    already exists and is a symlink, belongs to another user or is accessible to others."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    status = os.lstat(path)
+    if not stat.S_ISDIR(status.st_mode) or status.st_uid != os.getuid() or status.st_mode & 0o077:
+        raise OSError(f"{path} must be a directory accessible to its owner alone")
+
+
+def remove_stale_socket(socket_path: str) -> None:
+    """Removes the socket left at socket_path by a server which didn't exit cleanly,
+    raising OSError if a server is still listening on it."""
+    if not os.path.exists(socket_path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(socket_path)
+        except ConnectionRefusedError:
+            os.remove(socket_path)
+            return
+    raise OSError(f"A server is already listening on {socket_path}")
+
+
+def serve(socket_path: str = DEFAULT_SOCKET_PATH, workers: int = 1, queue_size: int = DEFAULT_QUEUE_SIZE) -> None:
+    """Serves jobs on socket_path until interrupted."""
+    with JobServer(socket_path, workers, queue_size) as server:
+        log.info(f"Serving on {socket_path} with {server.workers} workers")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            log.info("Shutting down")
+
+
+def request(jobs: Iterable[Dict[str, Any]], socket_path: str = DEFAULT_SOCKET_PATH) -> Iterator[Dict[str, Any]]:
+    """Sends jobs to the server at socket_path, yielding their results as they finish.
+
+    Jobs are sent from a separate thread, so the server can run them
+    concurrently and hold the sender back when its queue is full."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+
+        def send() -> None:
+            try:
+                with client.makefile("wb") as requests:
+                    for job in jobs:
+                        requests.write(json.dumps(job).encode() + b"\n")
+                        requests.flush()
+                client.shutdown(socket.SHUT_WR)
+            except OSError:
+                log.debug("Server closed the connection before every job was sent")
+
+        sender = threading.Thread(target=send, daemon=True)
+        sender.start()
+        with client.makefile("rb") as responses:
+            for line in responses:
+                yield json.loads(line)
+        sender.join()
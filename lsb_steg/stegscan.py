@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+    hide_stream.stegscan
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Batch steganalysis of whole directories of images. The reverse entropy
+    analysis of :mod:`reverse_entropy` (and optionally the LSB maps of
+    :mod:`StegDetect`) runs over a process pool, and each file's verdict is
+    cached in SQLite by content hash and analysis parameters, so unchanged
+    files are not analysed again. LSB maps are saved to their own directory,
+    which is left out of the scan so they aren't picked up as new images.
+
+    :copyright: (c) 2015 by R433.
+    :license: MIT License, see LICENSE.md for more details.
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import StegDetect
+import reverse_entropy
+
+log = logging.getLogger(__name__)
+
+# Extensions of the files picked up when scanning a directory
+IMAGE_EXTENSIONS = (".bmp", ".gif", ".jpeg", ".jpg", ".png", ".ppm", ".tga", ".tif", ".tiff", ".webp")
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "hide_stream", "stegscan.sqlite")
+
+# Part of the cache key, bump it when the analysis changes so older verdicts are not reused
+ANALYSIS_VERSION = 1
+
+# Directory the LSB maps are saved to, named after the image and its digest
+DEFAULT_MAPS_DIR = "stegscan-maps"
+
+# Size of the reads used to hash files
+HASH_CHUNK_SIZE = 1 << 20
+
+# New verdicts are committed to the cache in batches of this many
+CACHE_COMMIT_EVERY = 64
+
+
+def is_within(path: str, directory: str) -> bool:
+    path, directory = os.path.abspath(path), os.path.abspath(directory)
+    return os.path.splitdrive(path)[0] == os.path.splitdrive(directory)[0] and \
+        os.path.commonpath([path, directory]) == directory
+
+
+def find_images(patterns: Iterable[str], exclude: Iterable[str] = ()) -> List[str]:
+    """Returns the image files matched by patterns, each of which is a file, a directory,
+    which is searched recursively, or a glob. Each file is listed once, and files in the
+    directories of exclude are left out."""
+    exclude = list(exclude)
+    paths = []
+    for pattern in patterns:
+        for match in sorted(glob.glob(pattern, recursive=True)) or [pattern]:
+            if os.path.isdir(match):
+                for root, dirs, files in os.walk(match):
+                    dirs[:] = [name for name in dirs
+                               if not any(is_within(os.path.join(root, name), excluded) for excluded in exclude)]
+                    paths.extend(os.path.join(root, name) for name in sorted(files)
+                                 if name.lower().endswith(IMAGE_EXTENSIONS))
+            else:
+                paths.append(match)
+    return [path for path in dict.fromkeys(paths) if not any(is_within(path, excluded) for excluded in exclude)]
+
+
+def file_version(path: str) -> Tuple[int, int]:
+    """Returns the size and modification time of the file at path, which change along with its content."""
+    status = os.stat(path)
+    return status.st_size, status.st_mtime_ns
+
+
+def file_digest(path: str) -> str:
+    """Returns the SHA-256 of the file at path as a hex string."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class VerdictCache:
+    """Analysis results stored by the SHA-256 of the file and the analysis parameters."""
+
+    def __init__(self, path: str) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS verdicts "
+                                "(digest TEXT, params TEXT, result TEXT, PRIMARY KEY (digest, params))")
+
+    def get(self, digest: str, params: str) -> Optional[Dict[str, Any]]:
+        row = self.connection.execute("SELECT result FROM verdicts WHERE digest = ? AND params = ?",
+                                      (digest, params)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, digest: str, params: str, result: Dict[str, Any]) -> None:
+        self.connection.execute("INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?)",
+                                (digest, params, json.dumps(result)))
+
+    def commit(self) -> None:
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.commit()
+        self.connection.close()
+
+
+def analyse(path: str, block_size: Tuple[int, int], lsb_count: Optional[int],
+            lsb_map_path: Optional[str] = None) -> Dict[str, Any]:
+    """Runs the reverse entropy analysis of the image at path, and shows its lsb_count LSBs if given,
+    saved to lsb_map_path or else next to the image (see StegDetect.show_lsb).
+
+    Returns the verdict and statistics of the analysis, as stored in the cache."""
+    result = reverse_entropy.scan(path, block_size)
+    if lsb_count is not None:
+        StegDetect.show_lsb(path, lsb_count, output_path=lsb_map_path)
+    return {
+        "mean": result.mean,
+        "std": result.std,
+        "blocks": int(result.entropy_map.size),
+        "anomalies": len(result.anomalies),
+        "hidden_data_likely": result.hidden_data_likely,
+    }
+
+
+def lsb_map_path(path: str, digest: str, lsb_count: int, maps_dir: str) -> str:
+    """Returns the path in maps_dir of the LSB map of the image at path, named after
+    the image and its digest so that images of the same name don't collide."""
+    file_name, file_extension = os.path.splitext(os.path.basename(path))
+    return os.path.join(maps_dir, f"{file_name}_{digest[:12]}_{lsb_count}LSBs{file_extension}")
+
+
+def _analyse_file(path: str, digest: str, version: Tuple[int, int], block_size: Tuple[int, int],
+                  lsb_count: Optional[int], maps_dir: str) -> Dict[str, Any]:
+    """Worker task, returns the analysis of the file at path hashed to digest, or the error which stopped it.
+    The file's size and modification time must still match version, those it had when it was hashed."""
+    try:
+        map_path = lsb_map_path(path, digest, lsb_count, maps_dir) if lsb_count is not None else None
+        analysed = analyse(path, block_size, lsb_count, map_path)
+        if file_version(path) != version:
+            return {"error": "The file changed while it was analysed"}
+        return {"sha256": digest, **analysed}
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+
+
+def _hash_file(path: str) -> Dict[str, Any]:
+    try:
+        version = file_version(path)
+        return {"sha256": file_digest(path), "version": version}
+    except OSError as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+
+
+def scan(patterns: Iterable[str], workers: int = 1, block_size: Tuple[int, int] = (8, 8),
+         lsb_count: Optional[int] = None, cache_path: Optional[str] = DEFAULT_CACHE_PATH,
+         maps_dir: str = DEFAULT_MAPS_DIR) -> Iterator[Dict[str, Any]]:
+    """Analyses the images matched by patterns (see find_images) on a pool of processes,
+    yielding a result for each file as it is ready. The LSB maps of lsb_count, if given,
+    are saved to maps_dir, which isn't scanned.
+
+    Files are hashed first, and files whose digest and parameters are in the
+    cache at cache_path are not analysed again, their result has "cached" set.
+    Files which can't be read or analysed get an "error" instead of a verdict,
+    and aren't cached. Pass cache_path=None to disable the cache."""
+    paths = find_images(patterns, exclude=[maps_dir])
+    if lsb_count is not None:
+        os.makedirs(maps_dir, exist_ok=True)
+    params = json.dumps({"version": ANALYSIS_VERSION, "block_size": list(block_size), "lsb_count": lsb_count})
+    cache = VerdictCache(cache_path) if cache_path else None
+    try:
+        with ProcessPoolExecutor(max(workers, 1)) as pool:
+            to_analyse = []
+            for path, hashed in zip(paths, pool.map(_hash_file, paths, chunksize=16)):
+                cached = cache.get(hashed["sha256"], params) if cache and "error" not in hashed else None
+                if cached is not None:
+                    yield {"path": path, "sha256": hashed["sha256"], "cached": True, **cached}
+                elif "error" in hashed:
+                    yield {"path": path, "cached": False, **hashed}
+                else:
+                    to_analyse.append((path, hashed))
+
+            # the size and modification time of each file are checked again after its analysis,
+            # so a file changing since it was hashed isn't cached wrongly
+            futures = {pool.submit(_analyse_file, path, hashed["sha256"], hashed["version"], block_size, lsb_count,
+                                   maps_dir): path for path, hashed in to_analyse}
+            for done, future in enumerate(as_completed(futures), 1):
+                analysed = future.result()
+                if cache and "error" not in analysed:
+                    cache.put(analysed["sha256"], params, {k: v for k, v in analysed.items() if k != "sha256"})
+                    if done % CACHE_COMMIT_EVERY == 0:
+                        cache.commit()
+                yield {"path": futures[future], "cached": False, **analysed}
+    finally:
+        if cache:
+            cache.close()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+    hide_stream.timing
+    ~~~~~~~~~~~~~~~~~~
+
+    Named, nestable timing spans for the phases of hiding, recovering
+    and detecting data.
+
+    Every finished span is logged and handed to the registered collectors,
+    which is how the CLI's --timings option gathers them.
+
+    :copyright: (c) 2015 by R433.
+    :license: MIT License, see LICENSE.md for more details.
+"""
+import functools
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter_ns
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+
+log = logging.getLogger(__name__)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class Span:
+    """A timed phase, nested in the span that was open when it started."""
+    __slots__ = ("name", "parent", "start_ns", "duration_ns", "nbytes")
+
+    def __init__(self, name: str, parent: Optional["Span"], nbytes: Optional[int] = None) -> None:
+        self.name = name
+        self.parent = parent
+        self.start_ns = perf_counter_ns()
+        self.duration_ns = 0
+        # bytes processed in the span, may be set once they are known
+        self.nbytes = nbytes
+
+    @property
+    def path(self) -> str:
+        """The names of the spans this one is nested in, and its own, joined by slashes."""
+        return self.name if self.parent is None else f"{self.parent.path}/{self.name}"
+
+    @property
+    def depth(self) -> int:
+        return 0 if self.parent is None else self.parent.depth + 1
+
+    @property
+    def seconds(self) -> float:
+        return self.duration_ns / 1e9
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "path": self.path, "depth": self.depth, "start_ns": self.start_ns,
+                "duration_ns": self.duration_ns, "bytes": self.nbytes}
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+_collectors: List[Callable[[Span], None]] = []
+
+
+def add_collector(collector: Callable[[Span], None]) -> None:
+    """Calls collector with every span as it finishes."""
+    _collectors.append(collector)
+
+
+def remove_collector(collector: Callable[[Span], None]) -> None:
+    _collectors.remove(collector)
+
+
+@contextmanager
+def collect() -> Iterator[List[Span]]:
+    """Yields a list which the spans finishing inside the block are appended to."""
+    spans: List[Span] = []
+    add_collector(spans.append)
+    try:
+        yield spans
+    finally:
+        remove_collector(spans.append)
+
+
+@contextmanager
+def span(name: str, nbytes: Optional[int] = None) -> Iterator[Span]:
+    """Times the block as a span called name, which processes nbytes bytes.
+
+    The span is nested in the span open in the current context, if any."""
+    current = Span(name, _current_span.get(), nbytes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    finally:
+        current.duration_ns = perf_counter_ns() - current.start_ns
+        _current_span.reset(token)
+        processed = f" ({current.nbytes} B)" if current.nbytes is not None else ""
+        log.debug(f"{'  ' * current.depth}{current.name + processed:<30} in {current.seconds:.2f}s")
+        for collector in list(_collectors):
+            collector(current)
+
+
+def timed(name: str) -> Callable[[F], F]:
+    """Decorator timing every call of the decorated function as a span called name."""
+    def decorator(function: F) -> F:
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper  # type: ignore
+    return decorator